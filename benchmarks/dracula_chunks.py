@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# Compares wrapping every Daily Dracula entry at post time with reading the precomputed messages.
+# Run it from the repo root:
+#   python -m benchmarks.dracula_chunks
+
+import json
+import textwrap
+import timeit
+from pathlib import Path
+
+from cogs.dracula import DD_FILE, CHAR_LIMIT, DraculaCorpus, build_corpus, corpus_is_stale
+from cogs.utils.assets import AssetStore
+
+
+ROUNDS = 20
+
+
+def main():
+	if corpus_is_stale():
+		build_corpus()
+	entries = {day: text for day, text in json.loads(Path(DD_FILE).read_text()).items() if not day.startswith('_')}
+	corpus = DraculaCorpus(AssetStore())
+
+	def wrap():
+		for text in entries.values():
+			textwrap.wrap(text, width = CHAR_LIMIT, replace_whitespace = False, drop_whitespace = False)
+
+	def precomputed():
+		for day in entries:
+			corpus.messages(day)
+
+	print(f'{len(entries)} entries, {sum(len(text) for text in entries.values())} characters')
+	for name, func in [('textwrap.wrap', wrap), ('precomputed', precomputed)]:
+		elapsed = min(timeit.repeat(func, number = 1, repeat = ROUNDS))
+		print(f'{name:>14}: {elapsed * 1000:8.2f} ms for the whole corpus, {elapsed / len(entries) * 1000:6.3f} ms per entry')
+	corpus.close()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Load test of the Eliza cog: N sessions send a message at the same time and the reply latencies are measured.
+# With a non-blocking reply path the slowest reply stays around the longest humanized delay (1s),
+# no matter how many sessions are active. It also compares starting the sessions by loading doctor.txt every time
+# (the previous way) with sharing the script parsed once: start-up latency and memory per session.
+# Needs the eliza module in ./eliza, run it from the repo root:
+#   python -m benchmarks.eliza_sessions
+
+import asyncio
+import random
+import sys
+import time
+import timeit
+from types import SimpleNamespace
+
+from cogs.eliza import SCRIPT, ElizaCog, Session, approximate_size, load_script
+
+
+SESSIONS = (1, 10, 50, 200)
+ROUNDS = 20
+
+
+class Typing:
+	async def __aenter__(self):
+		pass
+
+	async def __aexit__(self, *exc):
+		pass
+
+
+class Message:
+	# Just enough of a discord.Message for the cog
+	def __init__(self, author_id, text):
+		self.author = SimpleNamespace(id = author_id, bot = False)
+		self.clean_content = text
+		self.channel = SimpleNamespace(typing = Typing)
+		self.sent = time.perf_counter()
+		self.latency = None
+
+	async def reply(self, text):
+		self.latency = time.perf_counter() - self.sent
+
+
+def load_per_session():
+	eliza = sys.modules['eliza'].Eliza()
+	eliza.load(SCRIPT)
+	return eliza
+
+
+def startup(cog):
+	print(f'{"start-up":>16} | {"ms/session":>10} | {"KiB/session":>11}')
+	count = max(SESSIONS)
+	for name, new in [('load per session', load_per_session), ('shared script', cog.SessionEliza)]:
+		elapsed = min(timeit.repeat(new, number = 1, repeat = ROUNDS))
+		# Shared objects are counted once, so the script shows up only once in the shared case
+		size = approximate_size([new() for _ in range(count)]) / count
+		print(f'{name:>16} | {elapsed * 1000:>10.3f} | {size / 1024:>11.1f}')
+	print()
+
+
+async def load_test(cog, sessions):
+	for user_id in range(sessions):
+		cog.SESSIONS.add(Session(user_id, None, cog.SessionEliza()))
+
+	messages = [Message(user_id, 'I feel like nobody listens to me.') for user_id in range(sessions)]
+	start = time.perf_counter()
+	await asyncio.gather(*[cog.on_message(message) for message in messages])
+	wall = time.perf_counter() - start
+	latencies = [message.latency for message in messages]
+	return wall, sum(latencies) / len(latencies), max(latencies)
+
+
+async def main():
+	sys.path.append('./eliza')
+	import eliza
+	random.seed(0)
+	bot = SimpleNamespace(user = SimpleNamespace(mentioned_in = lambda message: False))
+	cog = ElizaCog(bot, max(SESSIONS), load_script(eliza, SCRIPT))
+	startup(cog)
+	print(f'{"sessions":>8} | {"wall s":>7} | {"mean s":>7} | {"max s":>7}')
+	try:
+		for sessions in SESSIONS:
+			wall, mean, slowest = await load_test(cog, sessions)
+			print(f'{sessions:>8} | {wall:>7.3f} | {mean:>7.3f} | {slowest:>7.3f}')
+	finally:
+		cog._session_cleanup.cancel()
+
+
+if __name__ == '__main__':
+	asyncio.run(main())
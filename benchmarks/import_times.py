@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# Import-time breakdown of what the bot imports before it can log in, measured with -X importtime
+# in fresh interpreters, with the third-party modules that are only used later imported eagerly
+# (the previous way) and lazily. Also shows the max RSS of each interpreter. Run it from the repo root:
+#   python -m benchmarks.import_times
+
+import subprocess
+import sys
+from collections import defaultdict
+
+
+# What ebot.py and its helpers need to start
+STARTUP = 'import aiohttp, discord, pymongo'
+CASES = {
+	'eager': f'{STARTUP}; import emoji',
+	'lazy': f'{STARTUP}; from cogs.utils.lazy import lazy_import; lazy_import("emoji")',
+}
+RSS = 'import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'
+TOP = 8
+
+
+def measure(code):
+	result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'{code}; {RSS}'], capture_output = True, text = True, check = True)
+	# Lines look like "import time:       self [us] |  cumulative | imported package"
+	packages = defaultdict(int)
+	total = 0
+	for line in result.stderr.splitlines():
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		own, _, name = line.removeprefix('import time:').split('|')
+		packages[name.strip().split('.')[0]] += int(own)
+		total += int(own)
+	return total, int(result.stdout.split()[-1]), packages
+
+
+def main():
+	for case, code in CASES.items():
+		total, rss, packages = measure(code)
+		print(f'{case}: {total / 1000:.1f} ms importing, max RSS {rss / 1024:.1f} MiB')
+		for name, own in sorted(packages.items(), key = lambda item: item[1], reverse = True)[:TOP]:
+			print(f'  {name:>20}: {own / 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Compares the old per-mention update-then-insert award loop with the single bulk write.
+# Needs a running MongoDB (MONGO_SERVER/MONGO_PORT, same as the bot), run it from the repo root:
+#   python -m benchmarks.taco_award
+
+import asyncio
+import os
+import time
+
+import pymongo
+from pymongo import monitoring
+
+from cogs.taco import award_requests
+
+
+DB_NAME = 'ebot_benchmark'
+MENTIONS = (1, 2, 5, 10, 20, 50)
+ROUNDS = 20
+
+
+class RoundTrips(monitoring.CommandListener):
+	def __init__(self):
+		self.count = 0
+
+	def started(self, event):
+		self.count += 1
+
+	def succeeded(self, event):
+		pass
+
+	def failed(self, event):
+		pass
+
+
+async def loop_award(col, recipients, giver):
+	# The award path as it was before the bulk write
+	for user in recipients:
+		resp = await col.update_one({'_id': user}, {'$inc': {'tacos': 1}})
+		if resp.modified_count != 1:
+			await col.insert_one({'_id': user, 'tacos': 1, 'given': 0})
+	resp = await col.update_one({'_id': giver}, {'$inc': {'given': len(recipients)}})
+	if resp.modified_count != 1:
+		await col.insert_one({'_id': giver, 'tacos': 0, 'given': len(recipients)})
+
+
+async def bulk_award(col, recipients, giver):
+	await col.bulk_write(award_requests(recipients, giver))
+
+
+async def measure(award, col, listener, mentions):
+	await col.delete_many({})
+	listener.count = 0
+	start = time.perf_counter()
+	for i in range(ROUNDS):
+		recipients = list(range(i * mentions + 1, (i + 1) * mentions + 1))
+		await award(col, recipients, 0)
+	elapsed = time.perf_counter() - start
+	return listener.count / ROUNDS, elapsed / ROUNDS * 1000
+
+
+async def main():
+	MONGO_SERVER = os.environ.get('MONGO_SERVER', None)
+	MONGO_PORT = os.environ.get('MONGO_PORT', 27017)
+	listener = RoundTrips()
+	mongo = pymongo.AsyncMongoClient(f'mongodb://{MONGO_SERVER}:{MONGO_PORT}', event_listeners = [listener])
+	col = mongo[DB_NAME]['tacos']
+	print(f'{"mentions":>8} | {"loop trips":>10} | {"loop ms":>8} | {"bulk trips":>10} | {"bulk ms":>8}')
+	try:
+		for mentions in MENTIONS:
+			loop_trips, loop_ms = await measure(loop_award, col, listener, mentions)
+			bulk_trips, bulk_ms = await measure(bulk_award, col, listener, mentions)
+			print(f'{mentions:>8} | {loop_trips:>10.1f} | {loop_ms:>8.2f} | {bulk_trips:>10.1f} | {bulk_ms:>8.2f}')
+	finally:
+		await mongo.drop_database(DB_NAME)
+		await mongo.close()
+
+
+if __name__ == '__main__':
+	asyncio.run(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Compares rendering /define embed fields with a full BeautifulSoup parse (the previous way)
+# and with the streaming text extractor, over recorded Wiktionary responses.
+# A few payloads in the API's format are committed in benchmarks/payloads, more can be recorded
+# (needs network access). Run the benchmark from the repo root:
+#   python -m benchmarks.wiktionary_render
+#   python -m benchmarks.wiktionary_render --record take be a
+# The comparison needs beautifulsoup4, which the bot itself no longer uses.
+
+import argparse
+import json
+import logging
+import timeit
+import urllib.request
+from pathlib import Path
+from urllib.parse import quote
+
+from bs4 import BeautifulSoup
+
+from cogs.wiktionary import WiktionaryCog
+
+
+PAYLOADS = Path(__file__).parent / 'payloads'
+API = 'https://en.wiktionary.org/api/rest_v1/page/definition'
+ROUNDS = 20
+
+
+def record(words):
+	PAYLOADS.mkdir(exist_ok = True)
+	for word in words:
+		request = urllib.request.Request(f'{API}/{quote(word, safe = "")}', headers = {'User-Agent': 'ebot-benchmark'})
+		with urllib.request.urlopen(request) as response:
+			(PAYLOADS / f'{word}.json').write_bytes(response.read())
+		print(f'Recorded "{word}"')
+
+
+def render_with_soup(descriptions):
+	fields = []
+	for desc in descriptions:
+		definitions = '\n\n'.join([_def['definition'].strip() for _def in desc['definitions'] if _def['definition'] != '' and 'mw-reference-text' not in _def['definition']])
+		soup = BeautifulSoup(definitions, 'html.parser')
+		if len(soup.text) >= 1024:
+			end = soup.text[:1024].rfind('\n\n')
+			text = soup.text[:end]
+		else:
+			text = soup.text
+		fields.append((desc['partOfSpeech'], text))
+	return fields
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--record', nargs = '+', metavar = 'WORD', help = 'fetch and save the payloads of these words')
+	args = parser.parse_args()
+	if args.record:
+		record(args.record)
+		return
+
+	payloads = {path.stem: json.loads(path.read_text()).get('en', []) for path in sorted(PAYLOADS.glob('*.json'))}
+	if not payloads:
+		print(f'No payloads were found in {PAYLOADS}, record some first with --record.')
+		return
+	logging.getLogger('ebot').setLevel(logging.WARNING)
+	# Rendering doesn't need a bot
+	cog = WiktionaryCog(None)
+
+	print(f'{"word":>10} | {"KB":>6} | {"soup ms":>8} | {"stream ms":>9}')
+	for word, descriptions in payloads.items():
+		size = len(json.dumps(descriptions)) / 1024
+		soup = min(timeit.repeat(lambda: render_with_soup(descriptions), number = 1, repeat = ROUNDS))
+		stream = min(timeit.repeat(lambda: cog.render(descriptions), number = 1, repeat = ROUNDS))
+		print(f'{word:>10} | {size:>6.1f} | {soup * 1000:>8.2f} | {stream * 1000:>9.2f}')
+
+
+if __name__ == '__main__':
+	main()
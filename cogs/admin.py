@@ -17,6 +17,18 @@ class Admin(commands.Cog):
 			await self._logging(ctx, args)
 		elif topic in ['cog', 'cogs' , 'extension', 'extensions']:
 			await self._extensions(ctx, args)
+		elif topic in ['db', 'database', 'mongo']:
+			await self._database(ctx)
+		elif topic in ['trigger', 'triggers']:
+			await self._triggers(ctx)
+		elif topic in ['asset', 'assets']:
+			await self._assets(ctx, args)
+		elif topic in ['session', 'sessions', 'eliza']:
+			await self._sessions(ctx)
+		elif topic == 'startup':
+			await self._startup(ctx)
+		elif topic == 'watchdog':
+			await self._watchdog(ctx)
 
 	@manage.error
 	async def manage_error(self, ctx, error):
@@ -88,5 +100,57 @@ class Admin(commands.Cog):
 			self.logger.debug(f'Extensions: {msg}')
 
 
+	async def _database(self, ctx):
+		if self.bot.database.client is None:
+			msg = 'No cog is using the database.'
+		else:
+			stats = '\n'.join([f'{name}: {value}' for name, value in self.bot.database.stats.report().items()])
+			msg = f'MongoDB connection pool stats:\n{stats}'
+		await ctx.reply(msg)
+		self.logger.debug(msg)
+
+
+	async def _triggers(self, ctx):
+		msg = f'Message triggers:\n{self.bot.triggers.report()}'
+		await ctx.reply(msg)
+		self.logger.debug(msg)
+
+
+	async def _assets(self, ctx, args):
+		if args and args[0].lower() == 'reload':
+			try:
+				reloaded = self.bot.assets.reload(args[1] if len(args) > 1 else None)
+				msg = f'Reloaded assets: {reloaded}'
+			except OSError as e:
+				msg = f'Failed to reload assets: {e}'
+		else:
+			assets = '\n'.join([f'{path}: {size} bytes' for path, size in self.bot.assets.report().items()])
+			msg = f'The currently loaded assets are: \n{assets}'
+		await ctx.reply(msg)
+		self.logger.debug(msg)
+
+
+	async def _sessions(self, ctx):
+		cog = self.bot.get_cog('ElizaCog')
+		if cog is None:
+			msg = 'The Eliza extension is not loaded.'
+		else:
+			msg = f'Eliza sessions: {len(cog.SESSIONS)}/{cog.SESSIONS.max_sessions}, using about {cog.SESSIONS.nbytes() / 1024:.1f} KiB'
+		await ctx.reply(msg)
+		self.logger.debug(msg)
+
+
+	async def _startup(self, ctx):
+		msg = f'Startup:\n{self.bot.startup.report()}'
+		await ctx.reply(msg)
+		self.logger.debug(msg)
+
+
+	async def _watchdog(self, ctx):
+		msg = f'Watchdog:\n{self.bot.watchdog.report()}'
+		await ctx.reply(msg)
+		self.logger.debug(msg)
+
+
 async def setup(bot):
 	await bot.add_cog(Admin(bot))
@@ -1,14 +1,19 @@
+import asyncio
 import logging
 import os
 import json
+from collections import defaultdict
 from datetime import time, datetime, timezone
+from time import perf_counter
 from enum import IntEnum, auto
 
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 
-import pymongo
+from pymongo import IndexModel
+
+from cogs.utils.users import UserResolver
 
 POST_TIME = time(hour = 7, tzinfo = timezone.utc)
 
@@ -28,6 +33,23 @@ class Months(IntEnum):
 	December = auto()
 
 
+class Calendar:
+	# Whose birthday is on which day, by guild. It's kept in memory, so the daily post is a single lookup.
+	def __init__(self):
+		self.days = defaultdict(lambda: defaultdict(set))
+		self.dates = dict()
+
+	def set(self, guild_id, user_id, month, day):
+		previous = self.dates.get((guild_id, user_id))
+		if previous is not None:
+			self.days[previous][guild_id].discard(user_id)
+		self.dates[(guild_id, user_id)] = (month, day)
+		self.days[(month, day)][guild_id].add(user_id)
+
+	def on(self, month, day):
+		return {guild_id: users for guild_id, users in self.days.get((month, day), {}).items() if users}
+
+
 class Birthday(commands.Cog):
 	def __init__(self, bot, mongo, channel_ids):
 		self.bot = bot
@@ -35,9 +57,26 @@ class Birthday(commands.Cog):
 		botlogger = logging.getLogger('ebot')
 		self.logger = botlogger.getChild('BirthdayCog')
 		self.channel_ids = channel_ids
+		self.calendar = Calendar()
+		self.users = UserResolver(bot)
+		# Channels fetched on earlier days, by ID
+		self.channels = dict()
 		self.post_task.start()
 
 
+	async def cog_load(self):
+		self.bot.database.schema.register('birthdays', [IndexModel([('month', 1), ('day', 1)])])
+		# Only the servers with a birthday channel get posts, the rest is not needed in the calendar
+		await asyncio.gather(*[self._load_calendar(guild_id) for guild_id in self.channel_ids])
+		self.logger.debug(f'Loaded {len(self.calendar.dates)} birthdays.')
+
+	async def _load_calendar(self, guild_id):
+		db = self.mongo[guild_id]
+		await self.bot.database.schema.ensure(db, 'birthdays')
+		async for user in db['birthdays'].find():
+			self.calendar.set(guild_id, user['_id'], user['month'], user['day'])
+
+
 	def cog_unload(self):
 		self.post_task.cancel()
 
@@ -53,31 +92,53 @@ class Birthday(commands.Cog):
 		current_month = today.month
 		current_day = today.day
 
-		for guild in self.bot.guilds:
-			db = self.mongo[str(guild.id)]
-			if 'birthdays' not in db.list_collection_names():
-				# Skip this server if no birthdays are configured
-				continue
-			col = db['birthdays']
-			users = col.find({'$and': [{'month': current_month}, {'day': current_day}]})
-
-			embed = discord.Embed(title = ':birthday: Birthdays today :partying_face:', colour = discord.Colour.og_blurple())
-			for user in users:
-				user_obj = await get_user(self.bot, user['_id'])
-				if user_obj is not False:
-					self.logger.debug(f'Birthday today: {user_obj.display_name}')
-					embed.add_field(name = user_obj.display_name, value = '', inline = False)
-
-			if len(embed.fields) == 0:
-				# No users have birthday today
-				continue
-
-			channel = await get_channel(self.bot, self.channel_ids[str(guild.id)])
-			if channel:
-				self.logger.debug(f'Sending birthday embed to channel {channel.id} on server {guild.id}')
+		start = perf_counter()
+		# Skip the servers without a configured birthday channel
+		birthdays = {guild_id: users for guild_id, users in self.calendar.on(current_month, current_day).items() if guild_id in self.channel_ids}
+		guilds = list(birthdays)
+		lookup = perf_counter()
+
+		users, channels = await asyncio.gather(
+			asyncio.gather(*[self.users.resolve(birthdays[guild_id], self.bot.get_guild(int(guild_id))) for guild_id in guilds]),
+			asyncio.gather(*[self._get_channel(self.channel_ids[guild_id]) for guild_id in guilds]))
+		resolve = perf_counter()
+
+		results = await asyncio.gather(*[self._announce(*guild) for guild in zip(guilds, users, channels)], return_exceptions = True)
+		for guild_id, result in zip(guilds, results):
+			if isinstance(result, Exception):
+				self.logger.error(f'Failed to post birthdays on server {guild_id}: {result}')
+		send = perf_counter()
+		self.logger.info(f'Posted birthdays on {len(guilds)} servers in {send - start:.3f}s (lookup: {lookup - start:.3f}s, resolving: {resolve - lookup:.3f}s, sending: {send - resolve:.3f}s)')
+
+	async def _announce(self, guild_id, users, channel):
+		embed = discord.Embed(title = ':birthday: Birthdays today :partying_face:', colour = discord.Colour.og_blurple())
+		for user in users.values():
+			self.logger.debug(f'Birthday today: {user.display_name}')
+			embed.add_field(name = user.display_name, value = '', inline = False)
+
+		if len(embed.fields) == 0:
+			# None of the users could be found
+			return
+
+		if channel:
+			self.logger.debug(f'Sending birthday embed to channel {channel.id} on server {guild_id}')
+			try:
 				await channel.send(embed = embed)
-			else:
-				self.logger.debug(f'Invalid channel ID: {self.channel_ids[str(guild.id)]}')
+			except discord.NotFound:
+				# The channel is gone since it was cached
+				self.channels.pop(channel.id, None)
+				raise
+		else:
+			self.logger.debug(f'Invalid channel ID: {self.channel_ids[guild_id]}')
+
+	async def _get_channel(self, channel_id):
+		# The gateway cache first, then the channels fetched on earlier days
+		channel = self.bot.get_channel(int(channel_id)) or self.channels.get(int(channel_id))
+		if channel is None:
+			channel = await get_channel(self.bot, channel_id)
+			if channel:
+				self.channels[channel.id] = channel
+		return channel
 
 
 	@app_commands.command(description = 'Set the date of your birthday.')
@@ -90,7 +151,7 @@ class Birthday(commands.Cog):
 			await interaction.response.send_message('That date seems to be invalid!')
 		else:
 			await interaction.response.defer(ephemeral = True, thinking = True)
-			mongo_manage(self, interaction.guild_id, interaction.user.id, month, day)
+			await mongo_manage(self, interaction.guild_id, interaction.user.id, month, day)
 			await interaction.followup.send('Saved', ephemeral = True)
 
 	def validate_date(self, year, month, day):
@@ -119,26 +180,16 @@ async def get_channel(bot, channel_id):
 		return False
 
 
-async def get_user(bot, user_id):
-	try:
-		user = await bot.fetch_user(user_id)
-		return user
-	except discord.NotFound:
-		# The user does not exist
-		return False
-	except discord.HTTPException:
-		# Something is wrong with the ID
-		return False
-
-
-def mongo_manage(self, guild_id, user_id, month, day):
+async def mongo_manage(self, guild_id, user_id, month, day):
 	db = self.mongo[str(guild_id)]
+	await self.bot.database.schema.ensure(db, 'birthdays')
 	col = db['birthdays']
 	self.logger.debug(f'Updating birthday for user {user_id} on server {guild_id} to {month}/{day}')
-	resp = col.update_one({'_id': user_id}, {'$set': {'month': month, 'day': day}})
-	if resp.modified_count != 1:
+	# Upserting, setting the same date again would fail the insert fallback on the duplicate key
+	resp = await col.update_one({'_id': user_id}, {'$set': {'month': month, 'day': day}}, upsert = True)
+	if resp.upserted_id is not None:
 		self.logger.debug(f'First time setting a birthday for user {user_id} on server {guild_id}')
-		resp = col.insert_one({'_id': user_id, 'month': month, 'day': day})
+	self.calendar.set(str(guild_id), user_id, month, day)
 
 
 async def setup(bot):
@@ -152,11 +203,7 @@ async def setup(bot):
 		raise KeyError('The provided "BIRTHDAY_CHANNEL_IDS" environmental variable is an invalid JSON. The format is "BIRTHDAY_CHANNEL_IDS=\'{"server1_id": "channel1_id", "server2_id": "channel2_id"}\'"')
 
 	try:
-		MONGO_SERVER = os.environ.get('MONGO_SERVER', None)
-		MONGO_PORT = os.environ.get('MONGO_PORT', 27017)
-
-		mongo = pymongo.MongoClient(f'mongodb://{MONGO_SERVER}:{MONGO_PORT}')
-		mongo.admin.command('ping')
+		mongo = await bot.database.connect()
 	except:
 		raise KeyError('Cannot connect to MongoDB')
 	await bot.add_cog(Birthday(bot, mongo, channel_ids))
@@ -1,6 +1,10 @@
+import asyncio
 import json
+import os
+import re
 from pathlib import Path
 from datetime import time, datetime, timezone
+from time import perf_counter
 import logging
 import textwrap
 
@@ -8,26 +12,195 @@ import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 
+from cogs.utils.cache import TTLCache
+
 
 DD_FILE = 'data/daily_dracula.json'
+# Built from DD_FILE: the entries' messages one after another and the byte offsets of each date's messages
+DD_DATA = 'data/daily_dracula.dat'
+DD_INDEX = 'data/daily_dracula.idx'
+CORPUS_VERSION = 2   # bump when the built format changes, so it gets rebuilt
 POST_TIME = time(hour = 7, tzinfo = timezone.utc)
 CHAR_LIMIT = 2000    # Discord limit
+JOB_TTL = 24 * 60 * 60    # seconds a failed post can be resumed for
+
+
+class DraculaCorpus:
+	# Reads the ready-made messages of an entry straight from the memory-mapped data file
+	# of the asset store, only the small index is parsed. The files are looked up in the store
+	# on every read, so reloading the assets takes effect without reloading the cog.
+	def __init__(self, assets, data = DD_DATA, index = DD_INDEX):
+		self.assets = assets
+		self.data_path = data
+		self.index_path = index
+		self._index = None
+		self._index_buffer = None
+
+	def __getitem__(self, day):
+		return ''.join(self.messages(day))
+
+	@property
+	def index(self):
+		with self.assets.get(self.index_path) as view:
+			# Parsed again only when the store has a new buffer for it
+			if view.obj is not self._index_buffer:
+				self._index = json.loads(str(view, 'utf-8'))['entries']
+				self._index_buffer = view.obj
+		return self._index
+
+	def messages(self, day):
+		index = self.index[day]
+		with self.assets.get(self.data_path) as data:
+			return [str(data[offset:offset + length], 'utf-8') for offset, length in index]
+
+	def close(self):
+		# The buffers belong to the asset store, only letting go of the parsed index
+		self._index = None
+		self._index_buffer = None
+
+
+def plan_messages(text):
+	# Splits an entry into messages that fit Discord's limit, at paragraph boundaries where possible.
+	# Only paragraphs too long for a single message are wrapped. Joined together the messages give back the entry.
+	messages = []
+	current = ''
+	for paragraph in re.split(r'(?<=\n\n)', text):
+		if len(paragraph) <= CHAR_LIMIT:
+			parts = [paragraph]
+		else:
+			parts = textwrap.wrap(paragraph, width = CHAR_LIMIT, replace_whitespace = False, drop_whitespace = False, expand_tabs = False)
+		for part in parts:
+			if current and len(current) + len(part) > CHAR_LIMIT:
+				messages.append(current)
+				current = ''
+			current += part
+	if current:
+		messages.append(current)
+	return messages
+
+
+def build_corpus(source = DD_FILE, data = DD_DATA, index = DD_INDEX):
+	entries = json.loads(Path(source).read_text())
+	offsets = dict()
+	with open(f'{data}.tmp', 'wb') as f:
+		for day, text in entries.items():
+			if day.startswith('_'):
+				# Not an entry, eg. "_comment"
+				continue
+			offsets[day] = []
+			for msg in plan_messages(text):
+				raw = msg.encode()
+				offsets[day].append((f.tell(), len(raw)))
+				f.write(raw)
+	Path(f'{index}.tmp').write_text(json.dumps({'version': CORPUS_VERSION, 'char_limit': CHAR_LIMIT, 'entries': offsets}))
+	# Swapping in both files at the end, so a failed build never leaves a half written corpus behind
+	os.replace(f'{data}.tmp', data)
+	os.replace(f'{index}.tmp', index)
+
+
+def corpus_is_stale(source = DD_FILE, data = DD_DATA, index = DD_INDEX):
+	if not Path(data).is_file() or not Path(index).is_file():
+		return True
+	if Path(index).stat().st_mtime < Path(source).stat().st_mtime:
+		return True
+	try:
+		built = json.loads(Path(index).read_text())
+		return built['version'] != CORPUS_VERSION or built['char_limit'] != CHAR_LIMIT
+	except (json.decoder.JSONDecodeError, KeyError, TypeError):
+		# Built by an older version of the cog
+		return True
+
+
+class PostJob:
+	# One entry being posted to one channel. Everything is prepared upfront and the job
+	# remembers how far it got, so a failed post can be resumed instead of starting over.
+	def __init__(self, channel_id, header, messages, footer, thread_name):
+		self.channel_id = channel_id
+		self.header = header
+		self.messages = messages
+		self.footer = footer
+		self.thread_name = thread_name
+		self.header_sent = False
+		self.footer_sent = False
+		self.initial_message = None
+		self.thread = None
+		self.sent = 0
+		self.duration = 0.0
+		# A forced post and the scheduled one can run the same job, only one of them posts at a time
+		self.lock = asyncio.Lock()
+
+	@property
+	def done(self):
+		return self.footer_sent and self.sent == len(self.messages)
+
+	async def run(self, bot):
+		# Returns whether there was anything left to post
+		async with self.lock:
+			if self.done:
+				return False
+			await self._run(bot)
+			return True
+
+	async def _run(self, bot):
+		start = perf_counter()
+		try:
+			channel = bot.get_channel(self.channel_id) or await bot.fetch_channel(self.channel_id)
+			if not self.header_sent:
+				await channel.send(self.header)
+				self.header_sent = True
+			if self.initial_message is None:
+				self.initial_message = await channel.send(self.messages[0])
+				self.sent = 1
+			if len(self.messages) > 1 and self.thread is None:
+				self.thread = await self.initial_message.create_thread(name = self.thread_name)
+			# The footer marks the entry as complete, so it only goes out once the whole thread is posted
+			await self._send_thread()
+			await self._send_footer(channel)
+		finally:
+			self.duration += perf_counter() - start
+
+	async def _send_thread(self):
+		while self.sent < len(self.messages):
+			await self.thread.send(self.messages[self.sent])
+			self.sent += 1
+
+	async def _send_footer(self, channel):
+		if not self.footer_sent:
+			await channel.send(self.footer)
+			self.footer_sent = True
 
 
 class DailyDraculaCog(commands.Cog):
-	def __init__(self, bot):
+	def __init__(self, bot, mongo):
 		self.bot = bot
+		self.mongo = mongo
 		botlogger = logging.getLogger('ebot')
 		self.logger = botlogger.getChild('DailyDraculaCog')
-		self.DRACULA = json.loads(Path(DD_FILE).read_text())
-		self.CHANNEL_ID = None
+		self.DRACULA = DraculaCorpus(bot.assets)
+		# The configured channel of each guild, stored in the guild's "settings" collection too
+		self.CHANNELS = dict()
+		# The posts that failed midway, by channel and date
+		self.jobs = TTLCache(JOB_TTL)
 		self.post_task.start()
 
+	async def cog_load(self):
+		guilds = [name for name in await self.mongo.list_database_names() if name.isnumeric()]
+		settings = await asyncio.gather(*[self.mongo[guild]['settings'].find_one({'_id': 'dracula'}) for guild in guilds])
+		self.CHANNELS = {int(guild): setting['channel'] for guild, setting in zip(guilds, settings) if setting}
+		self.logger.debug(f'Feature is configured to use channels: {self.CHANNELS}')
+
 	def cog_unload(self):
 		self.post_task.cancel()
+		self.DRACULA.close()
 
 	async def post(self, interaction = None, date = ''):
-		if self.CHANNEL_ID is None:
+		# Forcing a post from a server only posts there, otherwise every configured channel gets it
+		if interaction is not None and interaction.guild_id is not None:
+			channels = [self.CHANNELS[interaction.guild_id]] if interaction.guild_id in self.CHANNELS else []
+		else:
+			channels = list(self.CHANNELS.values())
+
+		if not channels:
 			msg = 'Feature not configured yet!'
 			if interaction is not None:
 				await interaction.followup.send(msg, ephemeral = True)
@@ -42,25 +215,50 @@ class DailyDraculaCog(commands.Cog):
 			header = f'--- Post start for {today:%b} {today.day} ---'
 			footer = f'--- Post end for {today:%b} {today.day} ---'
 			try:
-				dracula = self.DRACULA[day]
-				messages = textwrap.wrap(dracula, width = CHAR_LIMIT, replace_whitespace = False, drop_whitespace = False)
-				channel = self.bot.get_channel(self.CHANNEL_ID)
-				self.logger.debug(f'Posting for {today}')
-				await channel.send(header)
-				initial_message = await channel.send(messages[0])
-				thread = None
-				if len(messages) > 1:
-					self.logger.debug('Long post, created thread...')
-					thread = await initial_message.create_thread(name = f'The events of {today:%b} {today.day}')
-				for i, msg in enumerate(messages):
-					if i > 0:
-						await thread.send(msg)
-				await channel.send(footer)
+				# Discord would reject whitespace only messages
+				messages = [msg for msg in self.DRACULA.messages(day) if msg.strip()]
 			except KeyError:
 				msg = f'No post for {day}'
 				if interaction is not None:
 					await interaction.followup.send(msg, ephemeral = True)
 				self.logger.debug(msg)
+				return
+
+			# Every channel gets the same prepared messages, posted side by side
+			self.jobs.expire()
+			self.logger.debug(f'Posting for {today} to {len(channels)} channels')
+			jobs = [self._job(channel_id, day, header, messages, footer, f'The events of {today:%b} {today.day}') for channel_id in channels]
+			results = await asyncio.gather(*[job.run(self.bot) for job in jobs], return_exceptions = True)
+			for job, result in zip(jobs, results):
+				if isinstance(result, discord.NotFound):
+					# The channel is gone, there is nothing to resume
+					self.jobs.pop((job.channel_id, day))
+					msg = f'Posting for {day} to channel {job.channel_id} failed, the channel was not found: {result}'
+				elif isinstance(result, discord.HTTPException):
+					msg = f'Posting for {day} to channel {job.channel_id} stopped after {job.sent}/{len(messages)} messages, post it again to continue: {result}'
+				elif isinstance(result, BaseException):
+					# Only logged, raising it would stop the daily schedule
+					msg = f'Posting for {day} to channel {job.channel_id} failed unexpectedly after {job.sent}/{len(messages)} messages: {result!r}'
+				elif not result:
+					self.jobs.pop((job.channel_id, day))
+					self.logger.debug(f'The post for {day} to channel {job.channel_id} was already done by another run')
+					continue
+				else:
+					self.jobs.pop((job.channel_id, day))
+					self.logger.info(f'Posted {len(messages)} messages for {day} to channel {job.channel_id} in {job.duration:.2f} seconds')
+					continue
+				if interaction is not None:
+					await interaction.followup.send(msg, ephemeral = True)
+				self.logger.error(msg, exc_info = None if isinstance(result, discord.HTTPException) else result)
+
+	def _job(self, channel_id, day, header, messages, footer, thread_name):
+		job = self.jobs.get((channel_id, day))
+		if job is None:
+			job = PostJob(channel_id, header, messages, footer, thread_name)
+			self.jobs.set((channel_id, day), job)
+		else:
+			self.logger.debug(f'Resuming the post for {day} to channel {channel_id} after {job.sent} messages')
+		return job
 
 	@tasks.loop(time = POST_TIME)
 	async def post_task(self):
@@ -77,11 +275,13 @@ class DailyDraculaCog(commands.Cog):
 			await interaction.response.send_message("Ah ah ah! You didn't say the magic word!", ephemeral = True, delete_after = 30)
 
 	@app_commands.command()
+	@app_commands.guild_only()
 	async def daily_dracula_init(self, interaction):
 		is_owner = await self.bot.is_owner(interaction.user)
 		if is_owner:
-			self.CHANNEL_ID = interaction.channel_id
-			self.logger.debug(f'Feature is configured to use channel: {self.CHANNEL_ID}')
+			await self.mongo[str(interaction.guild_id)]['settings'].update_one({'_id': 'dracula'}, {'$set': {'channel': interaction.channel_id}}, upsert = True)
+			self.CHANNELS[interaction.guild_id] = interaction.channel_id
+			self.logger.debug(f'Feature is configured to use channel {interaction.channel_id} on server {interaction.guild_id}')
 			await interaction.response.send_message('Feature configured successfully!', ephemeral = True)
 		else:
 			await interaction.response.send_message("Ah ah ah! You didn't say the magic word!", ephemeral = True, delete_after = 30)
@@ -90,4 +290,16 @@ class DailyDraculaCog(commands.Cog):
 async def setup(bot):
 	if not Path(DD_FILE).is_file():
 		raise Exception("No daily Dracula file was found or it's not readable!")
-	await bot.add_cog(DailyDraculaCog(bot))
+	if await asyncio.to_thread(corpus_is_stale):
+		logging.getLogger('ebot').getChild('DailyDraculaCog').info('Building the daily Dracula corpus...')
+		await asyncio.to_thread(build_corpus)
+		if DD_DATA in bot.assets:
+			# Loaded before the rebuild (eg. the extension is being reloaded)
+			bot.assets.reload(DD_DATA)
+			bot.assets.reload(DD_INDEX)
+
+	try:
+		mongo = await bot.database.connect()
+	except:
+		raise KeyError('Cannot connect to MongoDB')
+	await bot.add_cog(DailyDraculaCog(bot, mongo))
@@ -1,18 +1,18 @@
+import asyncio
 import logging
 import re
 import random
 import sys
 import os
-import io
-import base64
 from pathlib import Path
 # import math
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 
-import giphy_client
+from cogs.utils.cache import TTLCache
+from cogs.utils.dispatch import Trigger
 
 
 class Egg(commands.Cog):
@@ -22,7 +22,9 @@ class Egg(commands.Cog):
 		self.logger = botlogger.getChild('EggCog')
 		self.GIPHY_TOKEN = giphy_token
 		self.GIPHY_LIMIT = 25
-		self.giphy = giphy_client.DefaultApi()
+		self.GIPHY_API = 'https://api.giphy.com/v1/gifs'
+		# The URLs of the known GIFs don't change, they are fetched when the cog loads and refreshed now and then
+		self.gifs = TTLCache(24*60*60)
 		# self.YUGE_REGEX = re.compile(r'[h|y]u+ge', re.IGNORECASE)
 		# self.MAYBE_REGEX = re.compile(r'ma+ybe', re.IGNORECASE)
 		self.COCOA_REGEX = re.compile(r'(^|\s)cocoa', re.IGNORECASE)
@@ -37,7 +39,8 @@ class Egg(commands.Cog):
                        'l0HlJXtvGLbMQYjNS', '11BkowkONO4qGc', 'wcG2ivAWvpQs0',
                        '13FOmRwAHCqLp6', '3o6Ztqb8VuN88HvI0o', 'l0HlJXtvGLbMQYjNS')
 		fav_file = Path('data') / 'fav.b64'
-		self.FAVOURITE = fav_file.read_text() if fav_file.is_file() else None
+		# Decoded once by the asset store, when it's first needed
+		self.FAVOURITE = fav_file if fav_file.is_file() else None
 		# self.TIT_ID = 'uSGDIb6hP458c'
 		# self.BOOBY_ID = 'EExgR4RJV0CM6nfeKQ'
 		# self.BAN_IDS= ['CybZqG4etuZsA', '8FJCnrkqkyRzIswceT', 'HXcALJVPgaR4A',
@@ -55,60 +58,94 @@ class Egg(commands.Cog):
 		# 	self.THE_LEGEND_FILES = [file for file in self.THE_LEGEND_DIR.iterdir() if file.is_file()]
 
 
-	@commands.Cog.listener()
-	async def on_message(self, message):
+	async def cog_load(self):
+		self.bot.triggers.add(Trigger('egg-mention', self.reply_to_mention, r'<@!?[0-9]+>'))
+		self.bot.triggers.add(Trigger('egg-cocoa', self.send_gif, self.COCOA_REGEX))
+		# The first round of the loop prefetches the GIFs right away
+		self.refresh_gifs.start()
+
+	def cog_unload(self):
+		self.bot.triggers.remove('egg-mention')
+		self.bot.triggers.remove('egg-cocoa')
+		self.refresh_gifs.cancel()
+
+
+	async def reply_to_mention(self, message):
+		if self.bot.user.mentioned_in(message) and len(message.mentions) == 1:
+			if message.content == self.bot.user.mention:
+				await message.reply(f"Eeeey, what's up {message.author.mention}?")
+			elif question := self.SENTIENCE_REGEX.search(message.clean_content):
+				await message.reply(f'Indeed, I am {question.group(1)}!')
+
+
+	async def send_gif(self, message):
 		msg = None
-		if message.author.bot == False:
-			if self.bot.user.mentioned_in(message) and len(message.mentions) == 1:
-				if message.content == self.bot.user.mention:
-					await message.reply(f"Eeeey, what's up {message.author.mention}?")
-				elif question := self.SENTIENCE_REGEX.search(message.clean_content):
-					await message.reply(f'Indeed, I am {question.group(1)}!')
-			# if asking_for_the_legend := THE_LEGEND_REGEX.search(message.clean_content) and 'THE_LEGEND_FILES' in globals() and isinstance(THE_LEGEND_FILES, list):
-			# 	# Sending in multiple parts, as Discord only allows 10 images in one message
-			# 	number_of_images = len(THE_LEGEND_FILES)
-			# 	for batch in range(0, math.ceil(number_of_images / 10)):
-			# 		try:
-			# 			files = [discord.File(THE_LEGEND_FILES[i]) for i in range(10 * batch, 10 * batch + 10)]
-			# 		except IndexError:
-			# 			files = [discord.File(THE_LEGEND_FILES[i]) for i in range(10 * batch, number_of_images)]
-			# 		await message.channel.send(files = files)
-
-			if self.COCOA_REGEX.search(message.content):
-				msg = self.grab_specific_gif(random.choice(self.SEAGAL_IDS))
-			# elif self.YUGE_REGEX.search(message.content):
-			# 	msg = self.grab_specific_gif(self.YUGE_ID)
-			# elif self.MAYBE_REGEX.search(message.content):
-			# 	msg = self.grab_specific_gif(self.MAYBE_ID)
-			# elif 'tits' in message.clean_content or 'titties' in message.clean_content:
-			# 	msg = self.grab_specific_gif(self.TIT_ID)
-			# elif 'boobs' in message.clean_content or 'booby' in message.clean_content or 'boobies' in message.clean_content:
-			# 	msg = self.grab_specific_gif(self.BOOBY_ID)
-			# elif self.BAN_REGEX.search(message.content):
-			# 	msg = self.grab_specific_gif(random.choice(self.BAN_IDS))
+		# if asking_for_the_legend := THE_LEGEND_REGEX.search(message.clean_content) and 'THE_LEGEND_FILES' in globals() and isinstance(THE_LEGEND_FILES, list):
+		# 	# Sending in multiple parts, as Discord only allows 10 images in one message
+		# 	number_of_images = len(THE_LEGEND_FILES)
+		# 	for batch in range(0, math.ceil(number_of_images / 10)):
+		# 		try:
+		# 			files = [discord.File(THE_LEGEND_FILES[i]) for i in range(10 * batch, 10 * batch + 10)]
+		# 		except IndexError:
+		# 			files = [discord.File(THE_LEGEND_FILES[i]) for i in range(10 * batch, number_of_images)]
+		# 		await message.channel.send(files = files)
+
+		if self.COCOA_REGEX.search(message.content):
+			msg = await self.grab_specific_gif(random.choice(self.SEAGAL_IDS))
+		# elif self.YUGE_REGEX.search(message.content):
+		# 	msg = await self.grab_specific_gif(self.YUGE_ID)
+		# elif self.MAYBE_REGEX.search(message.content):
+		# 	msg = await self.grab_specific_gif(self.MAYBE_ID)
+		# elif 'tits' in message.clean_content or 'titties' in message.clean_content:
+		# 	msg = await self.grab_specific_gif(self.TIT_ID)
+		# elif 'boobs' in message.clean_content or 'booby' in message.clean_content or 'boobies' in message.clean_content:
+		# 	msg = await self.grab_specific_gif(self.BOOBY_ID)
+		# elif self.BAN_REGEX.search(message.content):
+		# 	msg = await self.grab_specific_gif(random.choice(self.BAN_IDS))
 
 		if msg:
 			await message.channel.send(msg)
 
 
-	def grab_random_gif(self, keyword):
-		api_response = self.giphy.gifs_search_get(self.GIPHY_TOKEN, keyword, limit = self.GIPHY_LIMIT)
-		url = api_response.data[random.randrange(self.GIPHY_LIMIT)].images.downsized_small.mp4
+	async def giphy(self, endpoint, **params):
+		async with self.bot.session.get(f'{self.GIPHY_API}/{endpoint}', params = {'api_key': self.GIPHY_TOKEN, **params}) as response:
+			response.raise_for_status()
+			return (await response.json())['data']
+
+	async def grab_random_gif(self, keyword):
+		data = await self.giphy('search', q = keyword, limit = self.GIPHY_LIMIT)
+		url = random.choice(data)['images']['downsized_small']['mp4']
 		self.logger.debug(f'Grabbed random "{keyword}" image: {url}')
 		return url
 
-	def grab_specific_gif(self, gif_id):
-		api_response = self.giphy.gifs_gif_id_get(self.GIPHY_TOKEN, gif_id)
-		url = api_response.data.images.downsized_small.mp4
+	async def grab_specific_gif(self, gif_id):
+		url = self.gifs.get(gif_id)
+		if url is None:
+			url = await self.fetch_specific_gif(gif_id)
+		return url
+
+	async def fetch_specific_gif(self, gif_id):
+		data = await self.giphy(gif_id)
+		url = data['images']['downsized_small']['mp4']
+		self.gifs.set(gif_id, url)
 		self.logger.debug(f'Grabbed "{gif_id}" image: {url}')
 		return url
 
+	@tasks.loop(hours = 12)
+	async def refresh_gifs(self):
+		gif_ids = list(set(self.SEAGAL_IDS))
+		results = await asyncio.gather(*[self.fetch_specific_gif(gif_id) for gif_id in gif_ids], return_exceptions = True)
+		failed = [gif_id for gif_id, result in zip(gif_ids, results) if isinstance(result, Exception)]
+		if failed:
+			# The previous URLs are kept until they expire, after that they are fetched when needed
+			self.logger.warning(f'Failed to fetch GIFs: {failed}')
+
 
 	# @commands.Cog.listener()
 	# async def on_member_remove(self, member):
 	# 	if self.GOODBYE_CHANNEL:
 	# 		self.logger.info(f'{member.id} left the server')
-	# 		gif = self.grab_random_gif('sassy')
+	# 		gif = await self.grab_random_gif('sassy')
 	# 		channel = self.bot.get_channel(self.GOODBYE_CHANNEL)
 	# 		if channel:
 	# 			await channel.send(f'Buh-bye, {member.name}!')
@@ -129,7 +166,7 @@ class Egg(commands.Cog):
 	@app_commands.command(description = 'Check who is my favourite Discord user is at the moment.')
 	async def favourite(self, interaction):
 		if self.FAVOURITE:
-			file = discord.File(io.BytesIO(base64.b64decode(self.FAVOURITE)), filename = 'you.jpg')
+			file = discord.File(self.bot.assets.open(self.FAVOURITE), filename = 'you.jpg')
 			await interaction.response.send_message("Let's keep this between us :shushing_face:", file = file, ephemeral = True, delete_after = 30)
 
 
@@ -1,40 +1,160 @@
-from datetime import datetime, timezone
-from time import sleep
+from collections import OrderedDict
+from types import FunctionType, MappingProxyType, ModuleType
+import asyncio
+import gc
+import importlib
+import logging
 import random
 import os
 import sys
+import time
 
 import discord
-from discord.channel import DMChannel
 from discord.ext import commands
 from discord.ext.tasks import loop
 
+from cogs.utils.dispatch import Trigger
+
+
+SESSION_TIMEOUT = 60 * 60    # seconds of inactivity
+SCRIPT = './eliza/doctor.txt'
+# The parts of an Eliza that come from the script
+SCRIPT_RULES = ('initials', 'finals', 'quits', 'pres', 'posts', 'synons', 'keys')
+
+
+class Session:
+	# Only what a conversation needs: the Eliza state and where to reach the user
+	__slots__ = ('user_id', 'channel_id', 'eliza', 'last_activity', 'lock')
+
+	def __init__(self, user_id, channel_id, eliza):
+		self.user_id = user_id
+		self.channel_id = channel_id
+		self.eliza = eliza
+		self.last_activity = time.monotonic()
+		# Keeps the replies of a session in order
+		self.lock = asyncio.Lock()
+
+
+class SessionStore:
+	# The active sessions by user, from the least recently active one to the most recent one.
+	# When the cap is reached, the least recently active sessions make room for the new ones.
+	def __init__(self, max_sessions, timeout):
+		self.max_sessions = max_sessions
+		self.timeout = timeout
+		self._sessions = OrderedDict()
+
+	def __len__(self):
+		return len(self._sessions)
+
+	def __contains__(self, user_id):
+		return user_id in self._sessions
+
+	def touch(self, user_id):
+		session = self._sessions.get(user_id)
+		if session is not None:
+			session.last_activity = time.monotonic()
+			self._sessions.move_to_end(user_id)
+		return session
+
+	def add(self, session):
+		# Returns the sessions that had to be evicted
+		self._sessions[session.user_id] = session
+		evicted = []
+		while len(self._sessions) > self.max_sessions:
+			evicted.append(self._sessions.popitem(last = False)[1])
+		return evicted
+
+	def pop(self, user_id):
+		return self._sessions.pop(user_id, None)
+
+	def pop_expired(self):
+		deadline = time.monotonic() - self.timeout
+		expired = []
+		while self._sessions and next(iter(self._sessions.values())).last_activity <= deadline:
+			expired.append(self._sessions.popitem(last = False)[1])
+		return expired
+
+	def nbytes(self):
+		return approximate_size([session.eliza for session in self._sessions.values()]) + sum([sys.getsizeof(session) for session in self._sessions.values()])
+
+
+def load_script(eliza, path):
+	# Parses the script once and returns an Eliza class whose instances share the parsed rules.
+	# The rules are frozen, a session only keeps its own memory and where it is in the reassembly lists.
+	template = eliza.Eliza()
+	template.load(path)
+	rules = {name: freeze(getattr(template, name)) for name in SCRIPT_RULES}
+
+	class SessionEliza(eliza.Eliza):
+		def __init__(self):
+			super().__init__()
+			self.__dict__.update(rules)
+			self.reasmb_indexes = dict()
+
+		def _next_reasmb(self, decomp):
+			# The shared decompositions can't keep the index, every session cycles through the answers on its own
+			index = self.reasmb_indexes.get(id(decomp), 0)
+			self.reasmb_indexes[id(decomp)] = index + 1
+			return decomp.reasmbs[index % len(decomp.reasmbs)]
+
+	return SessionEliza
+
+
+def freeze(rule):
+	if isinstance(rule, list):
+		return tuple(rule)
+	if isinstance(rule, dict):
+		return MappingProxyType(rule)
+	return rule
+
+
+def approximate_size(objects):
+	# Adds up the sizes of the objects and everything they reference, counting shared objects only once
+	seen = set()
+	stack = list(objects)
+	size = 0
+	while stack:
+		obj = stack.pop()
+		if id(obj) in seen or isinstance(obj, (type, ModuleType, FunctionType)):
+			continue
+		seen.add(id(obj))
+		size += sys.getsizeof(obj)
+		stack.extend(gc.get_referents(obj))
+	return size
+
 
 class ElizaCog(commands.Cog):
-	def __init__(self, bot):
+	def __init__(self, bot, max_sessions, session_eliza):
 		self.bot = bot
-		self.SESSIONS = dict()
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('ElizaCog')
+		self.SESSIONS = SessionStore(max_sessions, SESSION_TIMEOUT)
+		self.SessionEliza = session_eliza
 		self._session_cleanup.start()
 
+	async def cog_load(self):
+		self.bot.triggers.add(Trigger('eliza', self.on_message, scope = 'dm'))
+
+	def cog_unload(self):
+		self.bot.triggers.remove('eliza')
+		self._session_cleanup.cancel()
+
 	@commands.command()
 	@commands.dm_only()
 	async def doctor(self, message):
 		if message.author.bot == False:
 			view = self._prep_ui(message)
-			if self.SESSIONS.get(message.author.id, False):
-				await message.send(self.SESSIONS[message.author.id]['eliza'].final())
-				self.SESSIONS.pop(message.author.id)
+			session = self.SESSIONS.pop(message.author.id)
+			if session:
+				await message.send(session.eliza.final())
 				await message.send(view = view)
 			else:
 				await message.send(view = view)
-				self.SESSIONS[message.author.id] = {'last_activity': datetime.now(timezone.utc)}
-				self.SESSIONS[message.author.id]['context'] = message
-				# The module's availability was checked and it was imported in the setup function,
-				# so at this point it's already cached.
-				eliza = sys.modules['eliza']
-				self.SESSIONS[message.author.id]['eliza'] = eliza.Eliza()
-				self.SESSIONS[message.author.id]['eliza'].load('./eliza/doctor.txt')
-				await message.send(self.SESSIONS[message.author.id]['eliza'].initial())
+				session = Session(message.author.id, message.channel.id, self.SessionEliza())
+				for evicted in self.SESSIONS.add(session):
+					self.logger.debug(f'Too many sessions, closing the one of {evicted.user_id}')
+					await self._close(evicted)
+				await message.send(session.eliza.initial())
 
 	@doctor.error
 	async def doctor_error(self, ctx, error):
@@ -45,7 +165,7 @@ class ElizaCog(commands.Cog):
 	def _prep_ui(self, message):
 		if message is None:
 			item = discord.ui.Button(label = 'This session has timed out due to inactivity.', style = discord.ButtonStyle.red, disabled = True)
-		elif self.SESSIONS.get(message.author.id, False):
+		elif message.author.id in self.SESSIONS:
 			item = discord.ui.Button(label = 'The session has been stopped.', style = discord.ButtonStyle.red, disabled = True)
 		else:
 			item = discord.ui.Button(label = 'A new session has been started!', style = discord.ButtonStyle.green, disabled = True)
@@ -53,36 +173,40 @@ class ElizaCog(commands.Cog):
 		view.add_item(item)
 		return view
 
+	async def _close(self, session):
+		try:
+			channel = self.bot.get_channel(session.channel_id) or await self.bot.create_dm(discord.Object(id = session.user_id))
+			await channel.send(session.eliza.final())
+			await channel.send(view = self._prep_ui(None))
+		except discord.HTTPException as e:
+			self.logger.debug(f'Could not say goodbye to {session.user_id}: {e}')
 
-	@loop(minutes = 15)
+
+	@loop(minutes = 1)
 	async def _session_cleanup(self):
-		# Timeout sessions after 1 hour of inactivity
-		MAX_TIME = 60 * 60
-		NOW = datetime.now(timezone.utc)
-		expired_sessions = [[_id, session] for _id, session in self.SESSIONS.items() if (NOW - session['last_activity']).seconds >= MAX_TIME]
-		for _id, session in expired_sessions:
-				await session['context'].send(session['eliza'].final())
-				view = self._prep_ui(None)
-				await session['context'].send(view = view)
-				self.SESSIONS.pop(_id)
-
-
-	@commands.Cog.listener()
+		# Timeout sessions after SESSION_TIMEOUT of inactivity
+		for session in self.SESSIONS.pop_expired():
+			await self._close(session)
+
+
 	async def on_message(self, message):
-		if message.author.bot == False and isinstance(message.channel, DMChannel):
-			if not self.bot.user.mentioned_in(message):
-				if self.SESSIONS.get(message.author.id, False):
-					self.SESSIONS[message.author.id]['last_activity'] = datetime.now(timezone.utc)
-					async with message.channel.typing():
-						# Instead of replying instantly, wait a little and make it more human-like
-						sleep(random.randrange(2))
-						await message.reply(self.SESSIONS[message.author.id]['eliza'].respond(message.clean_content))
+		if not self.bot.user.mentioned_in(message):
+			session = self.SESSIONS.touch(message.author.id)
+			if session:
+				async with session.lock, message.channel.typing():
+					# Instead of replying instantly, wait a little and make it more human-like.
+					# Only this session waits, the answer is worked out in a worker thread meanwhile.
+					response, _ = await asyncio.gather(asyncio.to_thread(session.eliza.respond, message.clean_content), asyncio.sleep(random.randrange(2)))
+					await message.reply(response)
 
 
 async def setup(bot):
 	if os.path.isdir('./eliza'):
 		sys.path.append('./eliza')
-		import eliza
-		await bot.add_cog(ElizaCog(bot))
+		# Importing the module and parsing the script are done in a worker thread, so the other cogs keep loading
+		eliza = await asyncio.to_thread(importlib.import_module, 'eliza')
+		session_eliza = await asyncio.to_thread(load_script, eliza, SCRIPT)
+		max_sessions = int(os.environ.get('ELIZA_MAX_SESSIONS', 100))
+		await bot.add_cog(ElizaCog(bot, max_sessions, session_eliza))
 	else:
 		raise ModuleNotFoundError('The eliza module is not available. Eliza Cog will not start.')
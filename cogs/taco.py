@@ -1,16 +1,30 @@
+import asyncio
+import heapq
 import logging
 import re
 import os
 import json
 from random import choice
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
 from enum import StrEnum
 
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 import pymongo
+from pymongo import IndexModel, UpdateOne
+
+from cogs.utils.cache import TTLCache
+from cogs.utils.dispatch import Trigger
+from cogs.utils.notifier import Notifier
+from cogs.utils.users import UserResolver
+
+
+COOLDOWN = 15*60    # seconds, mirrored by the TTL index of the 'cooldown' collection
+BOARD_SIZE = 50     # the most users a leaderboard can show
+PENDING = 'pending' # the cooldown of an award that is still being saved
 
 
 class Boards(StrEnum):
@@ -19,6 +33,38 @@ class Boards(StrEnum):
 	givers = 'given'
 
 
+class Leaderboard:
+	# The top users of one board of a guild, kept up to date in memory.
+	# Scores only ever grow, so nobody outside the board can have more than the lowest score
+	# on it, which is what keeps the incremental updates exact.
+	def __init__(self, size, scores):
+		self.size = size
+		self.scores = scores
+		# With fewer users than the size, every user is on the board
+		self.complete = len(scores) < size
+
+	def top(self, limit):
+		return heapq.nlargest(limit, self.scores.items(), key = lambda user: user[1])
+
+	def unknown(self, user_ids):
+		# The users whose totals have to be looked up before they could be added to the board
+		if self.complete:
+			return []
+		return [user_id for user_id in user_ids if user_id not in self.scores]
+
+	def update(self, deltas, totals):
+		for user_id, delta in deltas.items():
+			if user_id in totals:
+				self.scores[user_id] = totals[user_id]
+			elif user_id in self.scores:
+				self.scores[user_id] += delta
+			elif self.complete:
+				self.scores[user_id] = delta
+		if len(self.scores) > self.size:
+			self.scores = dict(self.top(self.size))
+			self.complete = False
+
+
 class Taco(commands.Cog):
 	def __init__(self, bot, mongo, emojis, no_cooldown_groups, sassy_reply_users):
 		self.bot = bot
@@ -28,28 +74,61 @@ class Taco(commands.Cog):
 		botlogger = logging.getLogger('ebot')
 		self.logger = botlogger.getChild('TacoCog')
 		self.EMOJI_MAP = self._emoji_mapper(emojis)
+		# Active cooldowns per guild database, Mongo only keeps them for restarts
+		self.cooldowns = defaultdict(lambda: TTLCache(COOLDOWN))
+		self.notifier = Notifier()
+		self.users = UserResolver(bot)
+		# Leaderboards of the guilds where they were asked for, the lock keeps the
+		# database writes and the in-memory updates in the same order
+		self.boards = dict()
+		self.board_locks = defaultdict(asyncio.Lock)
 		self.SASSY_RESPONSES = ('Bruh...', 'My creator gave on up the idea of explaining this to you, so let me give it a try:\n\n@name <placeholder_for_emoji> Any optional message', 'Let\'s give this another shot, shall we?', 'Seriously?', '(‡ಠ╭╮ಠ)')
 
 
-	@commands.Cog.listener('on_message')
+	async def cog_load(self):
+		self.bot.database.schema.register('cooldown', [IndexModel('last_used', expireAfterSeconds = COOLDOWN)])
+		self.bot.database.schema.register('tacos', [IndexModel([(board.value, pymongo.DESCENDING), ('_id', pymongo.ASCENDING)]) for board in Boards])
+		await self._load_cooldowns()
+		self.notifier.start()
+		self._expire_cooldowns.start()
+		# Every taco (and sassy reply) needs one of the emojis, the exact format is checked per guild
+		emojis = '|'.join([emoji['emoji'] for emoji in self.EMOJI_MAP.values()])
+		self.bot.triggers.add(Trigger('taco', self.watching_out_for_tacos, emojis, scope = 'guild'))
+
+	def cog_unload(self):
+		self.bot.triggers.remove('taco')
+		self.notifier.stop()
+		self._expire_cooldowns.cancel()
+
+	@tasks.loop(seconds = COOLDOWN)
+	async def _expire_cooldowns(self):
+		# The cooldowns of users who don't post again would never be looked up (and dropped) otherwise
+		for name, cache in list(self.cooldowns.items()):
+			expired = cache.expire()
+			if not len(cache):
+				del self.cooldowns[name]
+			if expired:
+				self.logger.debug(f'Dropped {expired} expired cooldowns of {name}.')
+
+
 	async def watching_out_for_tacos(self, message):
-		if message.author.bot == False and not isinstance(message.channel, discord.channel.DMChannel):
-			msg = None
-			server = message.guild.id
-			try:
-				regex = self.EMOJI_MAP[server]['regex'] if server in self.EMOJI_MAP else self.EMOJI_MAP['default']['regex']
-				if regex.search(message.content):
-					self.logger.debug('It\'s TACO time!!!')
-					self.mongo_manage(message)
-					await self.notify_sender(message)
-					await self.notify_recepients(message)
-				elif self.SASSY_REPLY_USERS and message.author.id in self.SASSY_REPLY_USERS and len(message.mentions) > 0 and self.EMOJI_MAP[server]['emoji'] in message.content:
-					self.logger.debug('It\'s sassyness time!!!')
-					await self.send_sassy_reply(message)
-				else:
-					self.logger.debug(f'"{message.author.name}" sent: {message.clean_content}')
-			except ValueError as e:
-				await message.reply(e)
+		msg = None
+		server = message.guild.id
+		try:
+			regex = self.EMOJI_MAP[server]['regex'] if server in self.EMOJI_MAP else self.EMOJI_MAP['default']['regex']
+			if regex.search(message.content):
+				self.logger.debug('It\'s TACO time!!!')
+				await self.mongo_manage(message)
+				# The DMs are sent in the background, the award is already saved
+				self.notify_sender(message)
+				self.notify_recepients(message)
+			elif self.SASSY_REPLY_USERS and message.author.id in self.SASSY_REPLY_USERS and len(message.mentions) > 0 and self.EMOJI_MAP[server]['emoji'] in message.content:
+				self.logger.debug('It\'s sassyness time!!!')
+				await self.send_sassy_reply(message)
+			else:
+				self.logger.debug(f'"{message.author.name}" sent: {message.clean_content}')
+		except ValueError as e:
+			await message.reply(e)
 
 	@commands.command()
 	@commands.guild_only()
@@ -73,10 +152,16 @@ class Taco(commands.Cog):
 			emoji_map[server] = {'emoji': emoji, 'regex': regex}
 		return emoji_map
 
-	def _init_cooldown(self, db):
-		if 'cooldown' not in db.list_collection_names():
-			col = db['cooldown']
-			col.create_index('last_used', expireAfterSeconds = 15*60)
+	async def _load_cooldowns(self):
+		# Pre-warming the cooldown cache with the cooldowns that survived a restart
+		since = datetime.now(timezone.utc) - timedelta(seconds = COOLDOWN)
+		guilds = [name for name in await self.mongo.list_database_names() if name.isnumeric()]
+		for name in guilds:
+			async for cooldown in self.mongo[name]['cooldown'].find({'last_used': {'$gt': since}}):
+				last_used = cooldown['last_used'].replace(tzinfo = timezone.utc)
+				remaining = (last_used - since).total_seconds()
+				self.cooldowns[name].set(cooldown['_id'], True, ttl = remaining)
+		self.logger.debug(f'Loaded {sum(len(cache) for cache in self.cooldowns.values())} active cooldowns.')
 
 	def check_if_user_has_cooldown(self, db, author):
 		author_groups = {group.id for group in author.roles}
@@ -84,15 +169,19 @@ class Taco(commands.Cog):
 			self.logger.debug(f'{author.id} is in a group with no cooldown!')
 			return False
 		self.logger.debug(f'Checking if {author.id} is in cooldown...')
-		if [d for d in db['cooldown'].find({'_id': author.id})]:
+		if author.id in self.cooldowns[db.name]:
 			self.logger.debug(f'{author.id} has cooldown.')
 			raise ValueError('You recently used this feature, sit in a corner for a little...')
 		self.logger.debug(f'{author.id} has no cooldown.')
 		return True
 
 	def add_user_to_cooldown(self, db, author):
+		# Until the award is saved, a placeholder keeps the author's other messages from racing past
+		# the cooldown check. The returned write only persists the cooldown for restarts.
 		self.logger.debug(f'Giving {author} a cooldown...')
-		db['cooldown'].insert_one({'_id': author, 'last_used': datetime.now(timezone.utc)})
+		self.cooldowns[db.name].set(author, PENDING)
+		# Upserting, so two messages racing past the cooldown check can't collide on the key
+		return db['cooldown'].update_one({'_id': author}, {'$set': {'last_used': datetime.now(timezone.utc)}}, upsert = True)
 
 
 	def get_users(self, message):
@@ -100,29 +189,65 @@ class Taco(commands.Cog):
 			yield user.id
 
 
-	def mongo_manage(self, message):
+	async def mongo_manage(self, message):
 		self.check_if_self_ping(message)
 		self.check_for_bots(message)
 		db = self.mongo[f'{message.guild.id}']
-		self._init_cooldown(db)
-		col = db['tacos']
+		await self.bot.database.schema.ensure(db, 'cooldown')
+		await self.bot.database.schema.ensure(db, 'tacos')
 		cooldown = self.check_if_user_has_cooldown(db, message.author)
-		# Increasing taco number for awarded users
-		for user in self.get_users(message):
-			self.logger.debug(f'Adding 1 tacos to {user}...')
-			resp = col.update_one({'_id': user}, {'$inc': {'tacos': 1}})
-			if resp.modified_count != 1:
-				self.logger.debug(f'First time seeing {user}! They were given a taco.')
-				resp = col.insert_one({'_id': user, 'tacos': 1, 'given': 0})
-		# Increasing given number to awarding user
-		awardees = len(message.mentions)
-		self.logger.debug(f'Adding {awardees} given for {message.author.id}...')
-		resp = col.update_one({'_id': message.author.id}, {'$inc': {'given': awardees}})
-		if resp.modified_count != 1:
-			self.logger.debug(f'First time seeing {message.author.id}! There were giving out tacos.')
-			resp = col.insert_one({'_id': message.author.id, 'tacos': 0, 'given': awardees})
+		recipients = list(self.get_users(message))
+		self.logger.debug(f'Adding 1 tacos to {recipients} and {len(recipients)} given for {message.author.id}...')
+		writes = [db['tacos'].bulk_write(award_requests(recipients, message.author.id))]
 		if cooldown:
-			self.add_user_to_cooldown(db, message.author.id)
+			writes.append(self.add_user_to_cooldown(db, message.author.id))
+		async with self.board_locks[db.name]:
+			results = await asyncio.gather(*writes, return_exceptions = True)
+			failed = [result for result in results if isinstance(result, BaseException)]
+			if failed:
+				if cooldown:
+					await self._cancel_cooldown(db, message.author.id, persisted = not isinstance(results[-1], BaseException))
+				raise failed[0]
+			if cooldown:
+				# Counting the cooldown from when the award was saved
+				self.cooldowns[db.name].set(message.author.id, True)
+			await self._update_boards(db, recipients, message.author.id)
+
+	async def _cancel_cooldown(self, db, author, persisted):
+		# The award was not saved, so the author shouldn't sit out a cooldown for it
+		self.cooldowns[db.name].pop(author)
+		if persisted:
+			try:
+				await db['cooldown'].delete_one({'_id': author})
+			except pymongo.errors.PyMongoError as e:
+				self.logger.error(f'Could not remove the cooldown of {author} after a failed award: {e}')
+
+
+	async def _load_boards(self, db):
+		async with self.board_locks[db.name]:
+			if db.name not in self.boards:
+				self.logger.debug(f'Loading the leaderboards of {db.name}...')
+				await self.bot.database.schema.ensure(db, 'tacos')
+				boards = dict()
+				for board in Boards:
+					cursor = db['tacos'].find(projection = [board.value]).sort([(board.value, pymongo.DESCENDING), ('_id', pymongo.ASCENDING)]).limit(BOARD_SIZE)
+					boards[board] = Leaderboard(BOARD_SIZE, {user['_id']: user[board.value] async for user in cursor})
+				self.boards[db.name] = boards
+		return self.boards[db.name]
+
+	async def _update_boards(self, db, recipients, giver):
+		boards = self.boards.get(db.name)
+		if boards is None:
+			# Nobody asked for this guild's leaderboards yet, they will be loaded when needed
+			return
+		deltas = {Boards.receivers: dict.fromkeys(recipients, 1), Boards.givers: {giver: len(recipients)}}
+		unknown = {user_id for board, leaderboard in boards.items() for user_id in leaderboard.unknown(deltas[board])}
+		totals = dict()
+		if unknown:
+			self.logger.debug(f'Looking up the totals of {unknown} for the leaderboards...')
+			totals = {user['_id']: user async for user in db['tacos'].find({'_id': {'$in': list(unknown)}})}
+		for board, leaderboard in boards.items():
+			leaderboard.update(deltas[board], {user_id: user[board.value] for user_id, user in totals.items()})
 
 
 	def check_if_self_ping(self, message):
@@ -136,35 +261,35 @@ class Taco(commands.Cog):
 
 
 	async def print_leaderboard(self, interaction, board, limit):
-		if limit > 50:
-			limit = 50
+		if limit > BOARD_SIZE:
+			limit = BOARD_SIZE
 		elif limit < 0:
 			limit *= -1
 		await interaction.response.defer(thinking = True)
 		server = interaction.guild.id
 		db = self.mongo[f'{server}']
-		col = db['tacos']
-		ranking = [d for d in col.find().sort(board.value, pymongo.DESCENDING).limit(limit)]
+		boards = await self._load_boards(db)
 		emoji = self.EMOJI_MAP[server]['emoji'] if server in self.EMOJI_MAP else self.EMOJI_MAP['default']['emoji']
 		title = f'Top {limit} users with {emoji}' if board.value == 'tacos' else f'Top {limit} {emoji} givers'
 		embed = discord.Embed(title = title, colour = discord.Colour.dark_purple())
-		for user in ranking:
-			if user[board.value] > 0:
-				username = await self.bot.fetch_user(user['_id'])
-				embed.add_field(name = username, value = user[board.value], inline = False)
+		ranking = [(user_id, score) for user_id, score in boards[board].top(limit) if score > 0]
+		usernames = await self.users.resolve([user_id for user_id, _ in ranking], interaction.guild)
+		for user_id, score in ranking:
+			if user_id in usernames:
+				embed.add_field(name = usernames[user_id], value = score, inline = False)
 		await interaction.followup.send(embed = embed)
 
 
-	async def notify_sender(self, message):
+	def notify_sender(self, message):
 		self.logger.debug(f'Sending taco confirmation to sender: {message.author.id}')
 		recepient_list = ', '.join([user.mention for user in message.mentions])
-		await message.author.send(f'You\'ve sent a token of appreciation to: {recepient_list}!\nIt all happened here: {message.jump_url}', silent = True)
+		self.notifier.notify(message.author, f'You\'ve sent a token of appreciation to: {recepient_list}!\nIt all happened here: {message.jump_url}')
 
 
-	async def notify_recepients(self, message):
+	def notify_recepients(self, message):
 		for recepient in message.mentions:
 			self.logger.debug(f'Sending taco confirmation to recepient: {recepient.id}')
-			await recepient.send(f'You\'ve received a token of appreciation from {message.author.mention}!\nIt all happened here: {message.jump_url}', silent = True)
+			self.notifier.notify(recepient, f'You\'ve received a token of appreciation from {message.author.mention}!\nIt all happened here: {message.jump_url}')
 
 
 	async def send_sassy_reply(self, message):
@@ -172,6 +297,14 @@ class Taco(commands.Cog):
 		await message.reply(choice(self.SASSY_RESPONSES))
 
 
+def award_requests(recipients, giver):
+	# Every recipient and the giver are upserted, so a whole award is a single bulk write
+	# and first-time users are created without a separate insert
+	requests = [UpdateOne({'_id': user}, {'$inc': {'tacos': 1}, '$setOnInsert': {'given': 0}}, upsert = True) for user in recipients]
+	requests.append(UpdateOne({'_id': giver}, {'$inc': {'given': len(recipients)}, '$setOnInsert': {'tacos': 0}}, upsert = True))
+	return requests
+
+
 async def setup(bot):
 	try:
 		no_cooldown_groups = os.environ['NO_COOLDOWN_GROUPS'].strip("'")
@@ -202,11 +335,7 @@ async def setup(bot):
 
 
 	try:
-		MONGO_SERVER = os.environ.get('MONGO_SERVER', None)
-		MONGO_PORT = os.environ.get('MONGO_PORT', 27017)
-
-		mongo = pymongo.MongoClient(f'mongodb://{MONGO_SERVER}:{MONGO_PORT}')
-		mongo.admin.command('ping')
+		mongo = await bot.database.connect()
 	except:
 		raise KeyError('Cannot connect to MongoDB')
 	await bot.add_cog(Taco(bot, mongo, emojis, no_cooldown_groups, sassy_reply_users))
@@ -0,0 +1,84 @@
+import base64
+import io
+import logging
+import mmap
+from pathlib import Path
+
+
+class AssetReader(io.RawIOBase):
+	# A read-only file object over an asset's buffer, it shares the buffer instead of copying it
+	def __init__(self, view):
+		super().__init__()
+		self._view = view
+		self._pos = 0
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def readinto(self, buffer):
+		size = max(0, min(len(buffer), len(self._view) - self._pos))
+		buffer[:size] = self._view[self._pos:self._pos + size]
+		self._pos += size
+		return size
+
+	def seek(self, offset, whence = io.SEEK_SET):
+		if whence == io.SEEK_SET:
+			self._pos = offset
+		elif whence == io.SEEK_CUR:
+			self._pos += offset
+		elif whence == io.SEEK_END:
+			self._pos = len(self._view) + offset
+		else:
+			raise ValueError(f'Invalid whence ({whence})')
+		if self._pos < 0:
+			raise ValueError('Negative seek position')
+		return self._pos
+
+	def tell(self):
+		return self._pos
+
+
+class AssetStore:
+	# Loads the cogs' static files once and hands out read-only views of them.
+	# Base64 encoded files (.b64) are decoded once, everything else is memory-mapped.
+	def __init__(self):
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('AssetStore')
+		self._assets = dict()
+
+	def __contains__(self, path):
+		return str(path) in self._assets
+
+	def get(self, path):
+		path = str(path)
+		if path not in self._assets:
+			self._assets[path] = self._load(Path(path))
+		return memoryview(self._assets[path])
+
+	def open(self, path):
+		return AssetReader(self.get(path))
+
+	def reload(self, path = None):
+		# The old buffers stay valid for as long as someone is still using them
+		paths = [str(path)] if path is not None else list(self._assets)
+		for path in paths:
+			self._assets.pop(path, None)
+			self.get(path)
+			self.logger.debug(f'Reloaded asset "{path}"')
+		return paths
+
+	def report(self):
+		return {path: len(data) for path, data in self._assets.items()}
+
+	def _load(self, path):
+		self.logger.debug(f'Loading asset "{path}"')
+		if path.suffix == '.b64':
+			return base64.b64decode(path.read_bytes())
+		if path.stat().st_size == 0:
+			# Empty files can't be memory-mapped
+			return b''
+		with open(path, 'rb') as f:
+			return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+	# A small LRU mapping where every entry also expires after a while.
+	# Expired entries are dropped lazily on access or by calling expire().
+	def __init__(self, ttl, maxsize = None):
+		self.ttl = ttl
+		self.maxsize = maxsize
+		self._data = OrderedDict()
+
+	def __len__(self):
+		return len(self._data)
+
+	def __contains__(self, key):
+		return self.get(key, _MISSING) is not _MISSING
+
+	def get(self, key, default = None):
+		try:
+			value, expires = self._data[key]
+		except KeyError:
+			return default
+		if expires <= time.monotonic():
+			del self._data[key]
+			return default
+		self._data.move_to_end(key)
+		return value
+
+	def set(self, key, value, ttl = None):
+		ttl = self.ttl if ttl is None else ttl
+		self._data[key] = (value, time.monotonic() + ttl)
+		self._data.move_to_end(key)
+		if self.maxsize is not None:
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last = False)
+
+	def pop(self, key, default = None):
+		value, _ = self._data.pop(key, (default, None))
+		return value
+
+	def expire(self):
+		now = time.monotonic()
+		expired = [key for key, (_, expires) in self._data.items() if expires <= now]
+		for key in expired:
+			del self._data[key]
+		return len(expired)
+
+	def clear(self):
+		self._data.clear()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+
+import pymongo
+from pymongo import monitoring
+
+
+class SchemaRegistry:
+	# Remembers which guild databases already have their collections' indexes in place,
+	# so the bootstrapping (and its round trips) only happens once per database
+	def __init__(self):
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('SchemaRegistry')
+		self._indexes = dict()
+		self._ensured = set()
+
+	def register(self, collection, indexes):
+		# Registering again replaces the previous indexes (eg. on extension reload),
+		# so every database has to be checked again for this collection
+		self._indexes[collection] = list(indexes)
+		self.forget(collection = collection)
+
+	async def ensure(self, db, collection):
+		if (db.name, collection) in self._ensured:
+			return
+		indexes = self._indexes.get(collection, [])
+		if indexes:
+			self.logger.debug(f'Ensuring indexes of "{collection}" in database {db.name}')
+			await db[collection].create_indexes(indexes)
+		self._ensured.add((db.name, collection))
+
+	def forget(self, guild = None, collection = None):
+		# Without arguments everything is forgotten
+		self._ensured = {(name, col) for name, col in self._ensured if (guild is not None and name != str(guild)) or (collection is not None and col != collection)}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+	# Collects connection pool usage, so the pool can be sized for the busiest guilds
+	def __init__(self):
+		self.connections = 0
+		self.checked_out = 0
+		self.max_checked_out = 0
+		self.checkouts = 0
+		self.failed_checkouts = 0
+		self.wait_time = 0.0
+		self.max_wait_time = 0.0
+
+	def report(self):
+		return {
+			'open connections': self.connections,
+			'checked out': self.checked_out,
+			'max checked out': self.max_checked_out,
+			'checkouts': self.checkouts,
+			'failed checkouts': self.failed_checkouts,
+			'avg wait (ms)': round(self.wait_time / self.checkouts * 1000, 2) if self.checkouts else 0,
+			'max wait (ms)': round(self.max_wait_time * 1000, 2),
+		}
+
+	def connection_checked_out(self, event):
+		self.checkouts += 1
+		self.checked_out += 1
+		self.max_checked_out = max(self.max_checked_out, self.checked_out)
+		self.wait_time += event.duration
+		self.max_wait_time = max(self.max_wait_time, event.duration)
+
+	def connection_checked_in(self, event):
+		self.checked_out -= 1
+
+	def connection_check_out_failed(self, event):
+		self.failed_checkouts += 1
+
+	def connection_created(self, event):
+		self.connections += 1
+
+	def connection_closed(self, event):
+		self.connections -= 1
+
+	def connection_check_out_started(self, event):
+		pass
+
+	def connection_ready(self, event):
+		pass
+
+	def pool_created(self, event):
+		pass
+
+	def pool_ready(self, event):
+		pass
+
+	def pool_cleared(self, event):
+		pass
+
+	def pool_closed(self, event):
+		pass
+
+
+class Database:
+	# The bot's one MongoDB client, cogs borrow it instead of creating their own,
+	# so reloading an extension doesn't leak connection pools
+	def __init__(self):
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('Database')
+		self.schema = SchemaRegistry()
+		self.stats = PoolStats()
+		self.client = None
+		self._lock = asyncio.Lock()
+
+	async def connect(self):
+		async with self._lock:
+			if self.client is None:
+				MONGO_SERVER = os.environ.get('MONGO_SERVER', None)
+				MONGO_PORT = os.environ.get('MONGO_PORT', 27017)
+				options = {
+					'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+					'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+					'serverSelectionTimeoutMS': int(os.environ.get('MONGO_TIMEOUT', 30000)),
+				}
+				if 'MONGO_WAIT_QUEUE_TIMEOUT' in os.environ:
+					options['waitQueueTimeoutMS'] = int(os.environ['MONGO_WAIT_QUEUE_TIMEOUT'])
+
+				client = pymongo.AsyncMongoClient(f'mongodb://{MONGO_SERVER}:{MONGO_PORT}', event_listeners = [self.stats], **options)
+				try:
+					await client.admin.command('ping')
+				except:
+					await client.close()
+					raise
+				self.logger.info(f'Connected to MongoDB with {options}')
+				self.client = client
+		return self.client
+
+	async def close(self):
+		if self.client is not None:
+			await self.client.close()
+			self.client = None
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import re
+import time
+
+import discord
+
+
+# The flags that can be scoped to a part of a pattern, so they survive the merge
+SCOPED_FLAGS = {re.IGNORECASE: 'i', re.MULTILINE: 'm', re.DOTALL: 's', re.VERBOSE: 'x'}
+
+
+class Trigger:
+	# A cog's interest in messages: where they are sent ('guild', 'dm' or 'any') and
+	# what their content has to match. Without a pattern every message in scope is a hit.
+	def __init__(self, name, callback, pattern = None, scope = 'any'):
+		self.name = name
+		self.callback = callback
+		self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+		self.scope = scope
+		self.checks = 0
+		self.hits = 0
+		self.match_time = 0.0
+
+	def matches(self, message):
+		self.checks += 1
+		if self.pattern is None:
+			return True
+		start = time.perf_counter()
+		match = self.pattern.search(message.content)
+		self.match_time += time.perf_counter() - start
+		return match is not None
+
+	def merged_pattern(self):
+		flags = ''.join([letter for flag, letter in SCOPED_FLAGS.items() if self.pattern.flags & flag])
+		return f'(?{flags}:{self.pattern.pattern})' if flags else f'(?:{self.pattern.pattern})'
+
+
+class MessageRouter:
+	# Routes the messages to the cogs whose triggers they hit. All the patterns are merged
+	# into one matcher, so the (most common) messages that no cog cares about are
+	# dropped with a single scan, before running the triggers one by one.
+	def __init__(self):
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('MessageRouter')
+		self.triggers = dict()
+		self.matcher = None
+		self.messages = 0
+		self.filtered = 0
+		self.filter_time = 0.0
+		self._tasks = set()
+
+	def add(self, trigger):
+		self.triggers[trigger.name] = trigger
+		self._compile()
+
+	def remove(self, name):
+		self.triggers.pop(name, None)
+		self._compile()
+
+	def _compile(self):
+		patterns = [trigger.merged_pattern() for trigger in self.triggers.values() if trigger.pattern is not None]
+		self.matcher = re.compile('|'.join(patterns)) if patterns else None
+		self.logger.debug(f'Routing messages to {list(self.triggers)}')
+
+	def route(self, message):
+		self.messages += 1
+		scope = 'dm' if isinstance(message.channel, discord.DMChannel) else 'guild'
+		start = time.perf_counter()
+		hit = self.matcher is not None and self.matcher.search(message.content) is not None
+		self.filter_time += time.perf_counter() - start
+		if not hit:
+			self.filtered += 1
+
+		for trigger in list(self.triggers.values()):
+			if trigger.scope not in [scope, 'any'] or (trigger.pattern is not None and not hit):
+				continue
+			if trigger.matches(message):
+				trigger.hits += 1
+				# Just like discord.py does with listeners, every callback runs in its own task
+				task = asyncio.create_task(self._run(trigger, message))
+				self._tasks.add(task)
+				task.add_done_callback(self._tasks.discard)
+
+	async def _run(self, trigger, message):
+		try:
+			await trigger.callback(message)
+		except Exception:
+			self.logger.exception(f'Trigger "{trigger.name}" failed on message {message.id}')
+
+	def report(self):
+		lines = [f'Messages: {self.messages}, dropped by the matcher: {self.filtered}, matcher time: {self.filter_time * 1000:.2f} ms']
+		for trigger in self.triggers.values():
+			rate = trigger.hits / trigger.checks * 100 if trigger.checks else 0
+			lines.append(f'{trigger.name} ({trigger.scope}): {trigger.hits}/{trigger.checks} hits ({rate:.1f}%), match time: {trigger.match_time * 1000:.2f} ms')
+		return '\n'.join(lines)
@@ -0,0 +1,63 @@
+import importlib
+import importlib.util
+import logging
+import sys
+import threading
+import time
+
+
+# How long importing the lazy modules took, by name. The ones that were not used yet are missing.
+LOAD_TIMES = dict()
+_LAZY = dict()
+
+
+class LazyModule:
+	# Stands in for a module until one of its attributes is first used, then imports it.
+	# Unlike importlib's LazyLoader it's safe to use from several threads: the first use and
+	# the warm-up both import the module under the lock, so nobody sees it half executed.
+	def __init__(self, name):
+		self._name = name
+		self._module = None
+		self._lock = threading.Lock()
+
+	def __getattr__(self, attr):
+		# Only called for the attributes the stand-in doesn't have, ie. the module's
+		module = self._module
+		if module is None:
+			module = self._load()
+		return getattr(module, attr)
+
+	def __repr__(self):
+		return f'<lazy module "{self._name}"{" (imported)" if self._module is not None else ""}>'
+
+	def _load(self):
+		with self._lock:
+			if self._module is None:
+				start = time.perf_counter()
+				module = importlib.import_module(self._name)
+				LOAD_TIMES[self._name] = time.perf_counter() - start
+				logging.getLogger('ebot').getChild('lazy').debug(f'Imported "{self._name}" in {LOAD_TIMES[self._name] * 1000:.1f} ms')
+				self._module = module
+			return self._module
+
+
+def lazy_import(name):
+	# Returns a stand-in for the module, it's imported when one of its attributes is first used.
+	# Only for modules that are not needed to start the bot, eg. the ones serving a single command.
+	if name in sys.modules:
+		return sys.modules[name]
+	if importlib.util.find_spec(name) is None:
+		raise ModuleNotFoundError(f'No module named "{name}"', name = name)
+	_LAZY.setdefault(name, LazyModule(name))
+	return _LAZY[name]
+
+
+def warm_up():
+	# Imports the lazy modules that were not used yet, meant to run in a worker thread once the bot is ready
+	for module in list(_LAZY.values()):
+		module._load()
+	return list(_LAZY)
+
+
+def report():
+	return {name: LOAD_TIMES.get(name) for name in _LAZY}
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+
+CHAR_LIMIT = 2000    # Discord limit
+
+
+class Notifier:
+	# Sends DMs in the background with a limited number of workers, so the caller doesn't
+	# wait for them. Notifications to the same user arriving within `delay` seconds are
+	# coalesced into a single DM.
+	def __init__(self, concurrency = 5, delay = 1.0):
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('Notifier')
+		self.concurrency = concurrency
+		self.delay = delay
+		self._pending = dict()
+		self._queue = asyncio.Queue()
+		self._workers = []
+
+	def start(self):
+		self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+	def stop(self):
+		for worker in self._workers:
+			worker.cancel()
+		self._workers = []
+		if self._pending:
+			self.logger.warning(f'Dropping unsent notifications for {len(self._pending)} users.')
+			self._pending.clear()
+
+	def notify(self, user, text):
+		if user.id in self._pending:
+			self._pending[user.id][1].append(text)
+		else:
+			self._pending[user.id] = (user, [text])
+			self._queue.put_nowait((time.monotonic() + self.delay, user.id))
+
+	async def _worker(self):
+		while True:
+			ready, user_id = await self._queue.get()
+			try:
+				# Waiting out the rest of the burst for this user
+				await asyncio.sleep(ready - time.monotonic())
+				user, texts = self._pending.pop(user_id)
+				for msg in self._pack(texts):
+					await self._send(user, msg)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				self.logger.error(f'Failed to notify {user_id}: {e}')
+			finally:
+				self._queue.task_done()
+
+	async def _send(self, user, msg):
+		while True:
+			try:
+				await user.send(msg, silent = True)
+				return
+			except discord.RateLimited as e:
+				# discord.py only raises this when the wait would be too long, backing off this worker
+				self.logger.debug(f'Rate limited while notifying {user.id}, retrying in {e.retry_after:.1f}s')
+				await asyncio.sleep(e.retry_after)
+			except discord.Forbidden:
+				self.logger.debug(f'{user.id} does not accept DMs.')
+				return
+
+	def _pack(self, texts):
+		# Fitting as many notifications in one DM as the length limit allows
+		msg = ''
+		for text in texts:
+			if msg and len(msg) + len(text) + 2 > CHAR_LIMIT:
+				yield msg
+				msg = ''
+			msg = f'{msg}\n\n{text}' if msg else text
+		if msg:
+			yield msg
@@ -0,0 +1,128 @@
+import asyncio
+import importlib
+import logging
+import time
+from pathlib import Path
+
+from discord.ext import commands
+
+from cogs.utils import lazy
+
+
+class PreloadedLoader:
+	# Hands the module that was imported in a worker thread to load_extension, so it doesn't
+	# execute the module a second time on the event loop. Only once: the reloads use the module's own loader.
+	def __init__(self, module):
+		self.module = module
+		self.loader = module.__spec__.loader
+
+	def __getattr__(self, name):
+		return getattr(self.loader, name)
+
+	def create_module(self, spec):
+		return self.module
+
+	def exec_module(self, module):
+		# Already executed in the worker thread
+		self.module.__spec__.loader = self.loader
+
+
+class Startup:
+	# Loads the cogs and keeps track of where the startup time goes.
+	# The cog modules are imported in worker threads first, then the cogs are set up concurrently in waves.
+	# A cog that needs another one running declares it in its module, eg. DEPENDS_ON = ('taco',),
+	# and it's only set up in a wave after the ones it depends on.
+	def __init__(self, package = 'cogs'):
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('Startup')
+		self.package = package
+		self.started = time.perf_counter()
+		self.loaded_after = None
+		self.ready_after = None
+		self.imports = dict()     # seconds by cog
+		self.setups = dict()      # seconds by cog
+		self.failed = dict()      # the reason by cog
+		self.waves = []
+		self._warm_up = None
+
+	def discover(self):
+		return sorted([path.stem for path in Path(self.package).iterdir() if path.is_file() and path.suffix == '.py'])
+
+	async def load(self, bot):
+		names = self.discover()
+		modules = await asyncio.gather(*[asyncio.to_thread(self._import, name) for name in names])
+		dependencies = {name: set(getattr(module, 'DEPENDS_ON', ())) for name, module in zip(names, modules) if module is not None}
+		for wave in self._waves(dependencies):
+			self.waves.append(wave)
+			await asyncio.gather(*[self._setup(bot, name) for name in wave])
+		self.loaded_after = time.perf_counter() - self.started
+		self.logger.info(f'Loaded {len(self.setups)}/{len(names)} cogs in {len(self.waves)} wave(s), {self.loaded_after:.2f} s after start')
+
+	def ready(self):
+		# on_ready fires again after reconnecting, only the first one counts
+		if self.ready_after is None:
+			self.ready_after = time.perf_counter() - self.started
+			self.logger.info(f'Ready {self.ready_after:.2f} s after start')
+			self._warm_up = asyncio.create_task(self.warm_up())
+
+	async def warm_up(self):
+		# The lazily imported modules that were not needed yet are imported in a worker thread,
+		# so their first use doesn't have to wait for them
+		start = time.perf_counter()
+		modules = await asyncio.to_thread(lazy.warm_up)
+		self.logger.info(f'Warmed up the lazy imports {modules} in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+	def _import(self, name):
+		# Imports the module off the event loop, load_extension then picks up the imported module
+		start = time.perf_counter()
+		try:
+			module = importlib.import_module(f'{self.package}.{name}')
+		except Exception as e:
+			self.failed[name] = f'import failed: {e!r}'
+			self.logger.error(f'Error while importing "{name}" Cog!\n{e!r}')
+			return None
+		self.imports[name] = time.perf_counter() - start
+		module.__spec__.loader = PreloadedLoader(module)
+		return module
+
+	def _waves(self, dependencies):
+		pending = dict(dependencies)
+		running = set()
+		while pending:
+			wave = [name for name, needs in pending.items() if needs <= running]
+			if not wave:
+				for name, needs in pending.items():
+					self.failed[name] = f'missing dependencies: {sorted(needs - running)}'
+					self.logger.error(f'Not loading "{name}" Cog, it depends on {sorted(needs - running)} which are not running')
+				return
+			yield wave
+			for name in wave:
+				pending.pop(name)
+			running.update([name for name in wave if name in self.setups])
+
+	async def _setup(self, bot, name):
+		self.logger.info(f'Adding "{name}" Cog...')
+		start = time.perf_counter()
+		try:
+			await bot.load_extension(f'{self.package}.{name}')
+		except commands.errors.ExtensionError as e:
+			self.failed[name] = str(e)
+			self.logger.error(f'Error while loading "{name}" Cog!\n{e}')
+		else:
+			self.setups[name] = time.perf_counter() - start
+			self.logger.info(f'"{name}" Cog is now running! ({self.setups[name] * 1000:.0f} ms)')
+
+	def report(self):
+		loaded = f'{self.loaded_after:.2f} s' if self.loaded_after is not None else 'not yet'
+		ready = f'{self.ready_after:.2f} s' if self.ready_after is not None else 'not yet'
+		lines = [f'Cogs loaded after: {loaded}, ready after: {ready}', f'Waves: {self.waves}']
+		for name in sorted(self.imports.keys() | self.failed.keys()):
+			timings = f'import: {self.imports[name] * 1000:.0f} ms' if name in self.imports else 'import: -'
+			if name in self.setups:
+				timings += f', setup: {self.setups[name] * 1000:.0f} ms'
+			if name in self.failed:
+				timings += f', failed: {self.failed[name]}'
+			lines.append(f'{name}: {timings}')
+		for name, seconds in lazy.report().items():
+			lines.append(f'lazy "{name}": ' + (f'import: {seconds * 1000:.0f} ms' if seconds is not None else 'not imported yet'))
+		return '\n'.join(lines)
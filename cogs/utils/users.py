@@ -0,0 +1,44 @@
+import asyncio
+import logging
+
+import discord
+
+from cogs.utils.cache import TTLCache
+
+
+class UserResolver:
+	# Turns user IDs into user objects: the gateway cache first, then recently fetched users,
+	# and whatever is still missing is fetched concurrently.
+	def __init__(self, bot, concurrency = 10, ttl = 60*60, maxsize = 1000):
+		self.bot = bot
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('UserResolver')
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self.cache = TTLCache(ttl, maxsize = maxsize)
+
+	def get(self, user_id, guild = None):
+		user = guild.get_member(user_id) if guild is not None else None
+		return user or self.bot.get_user(user_id) or self.cache.get(user_id)
+
+	async def resolve(self, user_ids, guild = None):
+		# Returns a dict of the found users, unknown IDs are left out
+		users = {user_id: self.get(user_id, guild) for user_id in user_ids}
+		missing = [user_id for user_id, user in users.items() if user is None]
+		if missing:
+			self.logger.debug(f'Fetching {len(missing)} users missing from the caches...')
+			fetched = await asyncio.gather(*[self._fetch(user_id) for user_id in missing])
+			users.update(zip(missing, fetched))
+		return {user_id: user for user_id, user in users.items() if user is not None}
+
+	async def _fetch(self, user_id):
+		async with self.semaphore:
+			try:
+				user = await self.bot.fetch_user(user_id)
+			except discord.NotFound:
+				# The user does not exist
+				return None
+			except discord.HTTPException:
+				# Something is wrong with the ID
+				return None
+		self.cache.set(user_id, user)
+		return user
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+COGS = Path(__file__).resolve().parent.parent
+
+
+class Watchdog:
+	# Measures how late the event loop wakes up from a short sleep. That only tells that the loop was blocked,
+	# so a monitor thread looks at the loop thread's stack while it's still blocked, to find the cog that did it.
+	def __init__(self, interval = 0.1, threshold = 0.25, history = 50):
+		botlogger = logging.getLogger('ebot')
+		self.logger = botlogger.getChild('Watchdog')
+		self.interval = interval
+		self.threshold = threshold
+		self.incidents = deque(maxlen = history)
+		self.samples = 0
+		self.total_lag = 0.0
+		self.max_lag = 0.0
+		self._beat = time.monotonic()
+		self._loop_thread = None
+		self._stalled = None
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		self._task = None
+		self._thread = None
+
+	def start(self):
+		# Has to be called from the event loop
+		self._loop_thread = threading.get_ident()
+		self._beat = time.monotonic()
+		self._stop.clear()
+		self._task = asyncio.create_task(self._heartbeat())
+		self._thread = threading.Thread(target = self._monitor, name = 'ebot-watchdog', daemon = True)
+		self._thread.start()
+
+	async def stop(self):
+		self._stop.set()
+		if self._task is not None:
+			self._task.cancel()
+		if self._thread is not None:
+			await asyncio.to_thread(self._thread.join)
+
+	async def _heartbeat(self):
+		while True:
+			start = time.monotonic()
+			await asyncio.sleep(self.interval)
+			now = time.monotonic()
+			lag = max(0.0, now - start - self.interval)
+			self.samples += 1
+			self.total_lag += lag
+			self.max_lag = max(self.max_lag, lag)
+			with self._lock:
+				self._beat = now
+				incident, self._stalled = self._stalled, None
+			if incident is not None:
+				# The monitor already logged where the loop was stuck, only the final lag is left
+				incident['lag'] = lag
+				self.logger.warning(f'The event loop is running again after being blocked for {lag * 1000:.0f} ms')
+			elif lag >= self.threshold:
+				# Blocked for less than a monitor interval past the threshold, it was over before the stack could be seen
+				incident = self._incident(lag)
+				self.incidents.append(incident)
+				self.logger.warning(f'The event loop was blocked for {lag * 1000:.0f} ms by {self._describe(incident)}')
+
+	def _monitor(self):
+		while not self._stop.wait(self.interval):
+			with self._lock:
+				blocked = time.monotonic() - self._beat - self.interval
+				if blocked < self.threshold or self._stalled is not None:
+					continue
+				frame = sys._current_frames().get(self._loop_thread)
+				if frame is None:
+					continue
+				# Claimed under the lock, so the stall is only reported once. Building the snapshot reads
+				# the source files, it's done outside the lock to not hold up the loop once it recovers.
+				incident = self._stalled = self._incident()
+			incident.update(self._snapshot(frame))
+			del frame
+			# Logged right away, the loop might never recover
+			self.incidents.append(incident)
+			self.logger.warning(f'The event loop has been blocked for {blocked * 1000:.0f} ms by {self._describe(incident)}\n{incident["stack"]}'.rstrip())
+
+	def _snapshot(self, frame):
+		stack = traceback.extract_stack(frame)
+		# The outermost frame of a cog is what the loop ran (a command, listener or trigger),
+		# the innermost one is where it's stuck
+		frames = [summary for summary in stack if self._in_cog(summary.filename)]
+		incident = {'stack': ''.join(traceback.format_list(stack[-15:]))}
+		if frames:
+			incident['cog'] = Path(frames[0].filename).stem
+			incident['function'] = frames[0].name
+			incident['location'] = f'{Path(frames[-1].filename).name}:{frames[-1].lineno} in {frames[-1].name}'
+		return incident
+
+	@staticmethod
+	def _incident(lag = None):
+		return {'when': datetime.now(timezone.utc), 'lag': lag, 'cog': None, 'function': None, 'location': None, 'stack': ''}
+
+	@staticmethod
+	def _in_cog(filename):
+		path = Path(filename).resolve()
+		return path.parent == COGS and path.suffix == '.py'
+
+	@staticmethod
+	def _describe(incident):
+		if incident['cog'] is None:
+			return 'code outside the cogs' if incident['stack'] else 'something that could not be caught in the act'
+		return f'the "{incident["cog"]}" cog in {incident["function"]} (at {incident["location"]})'
+
+	def report(self, last = 5):
+		mean = self.total_lag / self.samples if self.samples else 0.0
+		lines = [f'Event loop lag: mean {mean * 1000:.1f} ms, max {self.max_lag * 1000:.0f} ms over {self.samples} samples, threshold: {self.threshold * 1000:.0f} ms',
+			f'Incidents: {len(self.incidents)}']
+		for incident in list(self.incidents)[-last:]:
+			lag = f'{incident["lag"] * 1000:.0f} ms' if incident['lag'] is not None else 'still blocked'
+			lines.append(f'{incident["when"]:%Y-%m-%d %H:%M:%S} UTC: {lag}, {self._describe(incident)}')
+		return '\n'.join(lines)
@@ -1,46 +1,122 @@
+import asyncio
 import logging
+import os
+from html.parser import HTMLParser
+from urllib.parse import quote
 
-import requests
-from bs4 import BeautifulSoup
+import aiohttp
 import discord
 from discord.ext import commands
 from discord import app_commands
 
+from cogs.utils.cache import TTLCache
+
+
+FIELD_LIMIT = 1024    # Discord limits the text length for embed fields at 1024 characters
+
+
+class TextExtractor(HTMLParser):
+	# Collects the text of an HTML snippet, but only up to `limit` characters
+	def __init__(self, limit):
+		super().__init__(convert_charrefs = True)
+		self.limit = limit
+		self.parts = []
+		self.length = 0
+		self.truncated = False
+
+	def handle_data(self, data):
+		room = self.limit - self.length
+		if len(data) > room:
+			data = data[:room]
+			self.truncated = True
+		self.parts.append(data)
+		self.length += len(data)
+
+
+def html_to_text(html, limit, step = 512):
+	# Feeding the HTML piece by piece, so the parsing stops soon after the limit is reached
+	parser = TextExtractor(limit)
+	for i in range(0, len(html), step):
+		parser.feed(html[i:i + step])
+		if parser.truncated:
+			break
+	else:
+		parser.close()
+	return ''.join(parser.parts), parser.truncated
+
 
 class WiktionaryCog(commands.Cog):
 	def __init__(self, bot):
 		self.bot = bot
 		botlogger = logging.getLogger('ebot')
 		self.logger = botlogger.getChild('WiktionaryCog')
-		self.API = 'https://en.wiktionary.org/api/rest_v1'
+		# Can be pointed to a local stand-in server for testing
+		self.API = os.environ.get('WIKTIONARY_API', 'https://en.wiktionary.org/api/rest_v1')
+		# The raw definitions and their rendered embed fields by word, no fields means the word was not found
+		self.cache = TTLCache(24*60*60, maxsize = 512)
+		self.NOT_FOUND_TTL = 10*60
 
 	@app_commands.command(name = 'define', description = 'Get the definition of a word from Wiktionary.')
 	@app_commands.describe(word = 'The word to define.')
 	async def get_definition(self, interaction, word: str):
 		await interaction.response.defer(thinking = True)
-		ENDPOINT = 'page/definition'
-		response = requests.get(f'{self.API}/{ENDPOINT}/{word}')
-		self.logger.debug(f'The response of {response.url} was HTTP{response.status_code}.')
-		if response.ok:
-			descriptions = response.json()['en']
+		word = ' '.join(word.split())
+		fields = await self.lookup(word)
+		if fields:
 			embed = discord.Embed(title = f'The definition(s) of "{word}":', colour = discord.Colour.og_blurple(), url = f'https://en.wiktionary.org/wiki/{word}')
 			embed.set_footer(text = f'asked by {interaction.user.name}\nsource: Wiktionary')
-			for desc in descriptions:
-				definitions = '\n\n'.join([_def['definition'].strip() for _def in desc['definitions'] if _def['definition'] != '' and 'mw-reference-text' not in _def['definition']])
-				soup = BeautifulSoup(definitions, 'html.parser')
-				if len(soup.text) >= 1024:
-					# Discord limits the text length for embed fields at 1024 characters
-					end = soup.text[:1024].rfind('\n\n')
-					text = soup.text[:end]
-					self.logger.debug(f'Definitions contained {len(soup.text)} characters, trimmed it down to fit embed.')
-				else:
-					text = soup.text
-				embed.add_field(name = desc['partOfSpeech'], value = text, inline = False)
+			for name, text in fields:
+				embed.add_field(name = name, value = text, inline = False)
 				embed.add_field(name = '---', value = '')
 			await interaction.followup.send(embed = embed)
 		else:
 			await interaction.followup.send('Ooops, something went wrong!\nTry a different word.', ephemeral = True)
 
+	async def lookup(self, word):
+		# Wiktionary's titles are case sensitive, so only the whitespace is normalized for the key
+		cached = self.cache.get(word)
+		if cached is not None:
+			self.logger.debug(f'Found "{word}" in the cache.')
+			return cached[1]
+
+		ENDPOINT = 'page/definition'
+		try:
+			async with self.bot.session.get(f'{self.API}/{ENDPOINT}/{quote(word, safe = "")}') as response:
+				self.logger.debug(f'The response of {response.url} was HTTP{response.status}.')
+				if response.ok:
+					descriptions = (await response.json()).get('en', [])
+					fields = self.render(descriptions)
+					self.cache.set(word, (descriptions, fields))
+				elif response.status == 404:
+					fields = []
+					self.cache.set(word, (None, fields), ttl = self.NOT_FOUND_TTL)
+				else:
+					# Not caching server errors, those might go away
+					fields = []
+		except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+			# Connection errors, the session's timeout and bodies that are not JSON
+			self.logger.error(f'Failed to look up "{word}": {e!r}')
+			fields = []
+		return fields
+
+	def render(self, descriptions):
+		fields = []
+		for desc in descriptions:
+			definitions = [_def['definition'].strip() for _def in desc['definitions'] if _def['definition'] != '' and 'mw-reference-text' not in _def['definition']]
+			text = ''
+			for definition in definitions:
+				separator = '\n\n' if text else ''
+				rendered, truncated = html_to_text(definition, FIELD_LIMIT - len(text) - len(separator))
+				if truncated:
+					if not text:
+						# Even the first definition is too long, cutting it instead
+						text = f'{rendered[:-1]}…'
+					self.logger.debug(f'Definitions of "{desc["partOfSpeech"]}" did not fit the embed, trimmed them down.')
+					break
+				text = f'{text}{separator}{rendered}'
+			fields.append((desc['partOfSpeech'], text))
+		return fields
+
 
 async def setup(bot):
 	await bot.add_cog(WiktionaryCog(bot))
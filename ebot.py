@@ -3,18 +3,26 @@
 import logging
 import os
 import sys
-from pathlib import Path
 import random
 
+import aiohttp
 import discord
 from discord.ext import commands, tasks
 
-from emoji import demojize
+from cogs.utils.assets import AssetStore
+from cogs.utils.database import Database
+from cogs.utils.dispatch import MessageRouter
+from cogs.utils.lazy import lazy_import
+from cogs.utils.startup import Startup
+from cogs.utils.watchdog import Watchdog
 
 
 logging.basicConfig(format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s', level = logging.INFO)
 botlogger = logging.getLogger('ebot')
 
+# Only the error handler needs it, it's imported on first use or in the warm-up once the bot is ready
+emoji = lazy_import('emoji')
+
 
 ###########################################
 #
@@ -29,16 +37,40 @@ except KeyError:
 
 class eBot(commands.Bot):
 	# Custom Bot class so we can load our cogs before the bot logs in
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.startup = Startup()
+		# Started with the event loop, it flags the code that keeps the loop blocked for too long (in seconds)
+		self.watchdog = Watchdog(threshold = float(os.environ.get('WATCHDOG_THRESHOLD', 0.25)))
+		# Shared between the cogs, so it survives extension reloads
+		self.database = Database()
+		self.triggers = MessageRouter()
+		self.assets = AssetStore()
+		# The HTTP session of the cogs, it's created once the event loop is running
+		self.session = None
+
 	async def setup_hook(self):
+		self.watchdog.start()
+		self.session = aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(total = 10))
 		botlogger.info('Loading cogs...')
-		for cog in [cog.stem for cog in Path('cogs').iterdir() if cog.is_file() and cog.suffix == '.py']:
-			try:
-				botlogger.info(f'Adding "{cog}" Cog...')
-				await bot.load_extension(f'cogs.{cog}')
-			except commands.errors.ExtensionFailed as e:
-				botlogger.error(f'Error while loading "{cog}" Cog!\n{e}')
-			else:
-				botlogger.info(f'"{cog}" Cog is now running!')
+		await self.startup.load(self)
+		botlogger.info(f'Startup report:\n{self.startup.report()}')
+
+
+	async def on_message(self, message):
+		# The one place messages are filtered, the cogs only get the ones their triggers hit
+		if message.author.bot:
+			return
+		self.triggers.route(message)
+		await self.process_commands(message)
+
+
+	async def close(self):
+		await self.watchdog.stop()
+		await self.database.close()
+		if self.session is not None:
+			await self.session.close()
+		await super().close()
 
 
 	@tasks.loop(hours = 1)
@@ -66,15 +98,22 @@ bot = eBot(intents = intents, command_prefix = commands.when_mentioned)
 @bot.event
 async def on_ready():
 	botlogger.info(f'We have logged in as {bot.user}')
+	bot.startup.ready()
 	sync = await bot.tree.sync()
 	botlogger.info(f'Synced {len(sync)} commands')
 	await bot.activity_change.start()
 
 
+@bot.event
+async def on_guild_join(guild):
+	# The new guild's database might be set up differently (or not at all) than what we remember
+	bot.database.schema.forget(guild = guild.id)
+
+
 @bot.event
 async def on_command_error(ctx, error):
 	# We don't want to care about "commands" that are simply emojis sent to the bot
-	command = demojize(ctx.invoked_with)
+	command = emoji.demojize(ctx.invoked_with)
 	if command.startswith('<:') or command.startswith(':'):
 		return
 
@@ -0,0 +1,82 @@
+# Runs /define lookups against a local stand-in for the Wiktionary API, from the repo root:
+#   python -m unittest tests.test_wiktionary
+
+import asyncio
+import unittest
+from collections import Counter
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from cogs.wiktionary import WiktionaryCog
+
+
+DEFINITION = {'en': [{'partOfSpeech': 'Verb', 'language': 'English', 'definitions': [{'definition': 'To <b>put</b> something down.'}]}]}
+
+
+class StandIn:
+	# Answers like the Wiktionary API does and counts the requests by word
+	def __init__(self):
+		self.requests = Counter()
+		self.app = web.Application()
+		self.app.router.add_get('/page/definition/{word}', self.definition)
+
+	async def definition(self, request):
+		word = request.match_info['word']
+		self.requests[word] += 1
+		if word == 'set':
+			return web.json_response(DEFINITION)
+		if word == 'missing':
+			return web.json_response({'title': 'Not found.'}, status = 404)
+		if word == 'garbled':
+			return web.Response(text = '{"en": [', content_type = 'application/json')
+		if word == 'slow':
+			await asyncio.sleep(1)
+			return web.json_response(DEFINITION)
+		return web.json_response({'title': 'Internal error.'}, status = 500)
+
+
+class LookupTest(unittest.IsolatedAsyncioTestCase):
+	async def asyncSetUp(self):
+		self.stand_in = StandIn()
+		self.server = TestServer(self.stand_in.app)
+		await self.server.start_server()
+		session = aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(total = 0.5))
+		self.cog = WiktionaryCog(SimpleNamespace(session = session))
+		self.cog.API = str(self.server.make_url('')).rstrip('/')
+
+	async def asyncTearDown(self):
+		await self.cog.bot.session.close()
+		await self.server.close()
+
+	async def test_hit(self):
+		fields = await self.cog.lookup('set')
+		self.assertEqual(fields, [('Verb', 'To put something down.')])
+
+	async def test_repeat_is_cached(self):
+		first = await self.cog.lookup('set')
+		second = await self.cog.lookup('set')
+		self.assertEqual(first, second)
+		self.assertEqual(self.stand_in.requests['set'], 1)
+
+	async def test_not_found_is_cached(self):
+		self.assertEqual(await self.cog.lookup('missing'), [])
+		self.assertEqual(await self.cog.lookup('missing'), [])
+		self.assertEqual(self.stand_in.requests['missing'], 1)
+
+	async def test_server_error_is_not_cached(self):
+		self.assertEqual(await self.cog.lookup('broken'), [])
+		self.assertEqual(await self.cog.lookup('broken'), [])
+		self.assertEqual(self.stand_in.requests['broken'], 2)
+
+	async def test_invalid_json(self):
+		self.assertEqual(await self.cog.lookup('garbled'), [])
+
+	async def test_timeout(self):
+		self.assertEqual(await self.cog.lookup('slow'), [])
+
+
+if __name__ == '__main__':
+	unittest.main()